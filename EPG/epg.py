@@ -1,9 +1,90 @@
 import requests
 import csv
-from datetime import datetime
+from datetime import datetime, timedelta
 import re
 import os
 import logging
+import json
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+
+# Fetch settings (override via environment variables)
+MAX_WORKERS = max(1, int(os.getenv('EPG_MAX_WORKERS', '8')))   # Concurrent channel fetches
+HOST_RATE_LIMIT = float(os.getenv('EPG_HOST_RATE_LIMIT', '10')) # Max requests per second per host (0 = unlimited)
+REQUEST_TIMEOUT = float(os.getenv('EPG_REQUEST_TIMEOUT', '30')) # Seconds
+INCREMENTAL = os.getenv('EPG_INCREMENTAL', '0') == '1'          # Conditional requests + only new/changed events
+STREAMING = os.getenv('EPG_STREAMING', '0') == '1'              # Parse response.schedule incrementally (needs ijson)
+OUTPUT_FORMAT = os.getenv('EPG_OUTPUT_FORMAT', 'csv').lower()   # csv | parquet | feather
+
+FIELDNAMES = ['eventId', 'title', 'description', 'datetime', 'eventStartMyt', 'eventEndMyt', 'duration', 'genre', 'subGenre']
+
+# Optional dependency for streaming mode
+try:
+    import ijson
+except ImportError:
+    ijson = None
+if STREAMING and ijson is None:
+    raise ImportError("EPG_STREAMING=1 requires the 'ijson' package (pip install ijson)")
+
+# Optional dependency for the columnar store
+if OUTPUT_FORMAT not in ('csv', 'parquet', 'feather'):
+    raise ValueError(f"EPG_OUTPUT_FORMAT must be csv, parquet or feather, got '{OUTPUT_FORMAT}'")
+if OUTPUT_FORMAT != 'csv':
+    try:
+        import pyarrow as pa
+        if OUTPUT_FORMAT == 'parquet':
+            import pyarrow.parquet as pq
+            read_table, write_table = pq.read_table, pq.write_table
+        else:
+            import pyarrow.feather as feather
+            read_table, write_table = feather.read_table, feather.write_feather
+    except ImportError:
+        raise ImportError(f"EPG_OUTPUT_FORMAT={OUTPUT_FORMAT} requires the 'pyarrow' package (pip install pyarrow)")
+
+    # date and channel come from the hive-style partition path
+    STORE_SCHEMA = pa.schema([
+        ('eventId', pa.string()),
+        ('title', pa.string()),
+        ('description', pa.string()),
+        ('datetime', pa.string()),
+        ('eventStartMyt', pa.timestamp('s')),
+        ('eventEndMyt', pa.timestamp('s')),
+        ('duration', pa.duration('s')),
+        ('genre', pa.string()),
+        ('subGenre', pa.string()),
+    ])
+
+# Matches each event object inside response.schedule.<date>[]
+SCHEDULE_ITEM_PREFIX = re.compile(r'^response\.schedule\.[^.]+\.item$')
+
+class HostRateLimiter:
+    """Spaces out requests to the same host so the pool never bursts past HOST_RATE_LIMIT."""
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.lock = threading.Lock()
+        self.next_slot = {}
+
+    def wait(self, url):
+        if not self.interval:
+            return
+        host = urlparse(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+# Shared pooled HTTP session sized to the worker pool
+session = requests.Session()
+adapter = HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS)
+session.mount('http://', adapter)
+session.mount('https://', adapter)
+host_limiter = HostRateLimiter(HOST_RATE_LIMIT)
 
 # Function to sanitize filename by replacing or removing unsafe characters
 def sanitize_filename(name):
@@ -16,6 +97,44 @@ current_date = datetime.now().strftime("%Y%m%d")
 output_dir = "astro_channel_reports"
 os.makedirs(output_dir, exist_ok=True)
 
+# Root of the partitioned columnar dataset (EPG_OUTPUT_FORMAT=parquet|feather)
+store_dir = "epg_store"
+if OUTPUT_FORMAT != 'csv':
+    os.makedirs(store_dir, exist_ok=True)
+
+# Directory holding the per-channel schedule cache (incremental mode)
+cache_dir = "epg_cache"
+if INCREMENTAL:
+    os.makedirs(cache_dir, exist_ok=True)
+
+# Per-channel cache: validators and content hash for the URL, plus a hash per eventId
+def load_channel_cache(safe_channel_name, url):
+    cache_path = os.path.join(cache_dir, f"{safe_channel_name}.json")
+    try:
+        with open(cache_path, encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {'url': url, 'events': {}}
+    # A new link in channel.csv invalidates the cached validators and events
+    if cache.get('url') != url:
+        return {'url': url, 'events': {}}
+    return cache
+
+def save_channel_cache(safe_channel_name, cache):
+    cache_path = os.path.join(cache_dir, f"{safe_channel_name}.json")
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, ensure_ascii=False)
+    os.replace(tmp_path, cache_path)
+
+def update_validators(cache, response):
+    for header, key in (('ETag', 'etag'), ('Last-Modified', 'last_modified')):
+        if response.headers.get(header):
+            cache[key] = response.headers[header]
+
+def event_hash(program):
+    return hashlib.sha256(json.dumps(program, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
 # Directory to save logs
 log_dir = "log"
 os.makedirs(log_dir, exist_ok=True)
@@ -46,72 +165,306 @@ with open('channel.csv', newline='', encoding='utf-8-sig') as csvfile:
             channels.append((channel_name, link))
 
 logging.info(f"Found {len(channels)} channels to process.")
+logging.info(f"Fetching with {MAX_WORKERS} workers, {HOST_RATE_LIMIT} req/s per host")
 
-# Iterate over each channel and fetch data, write separate CSV for each channel
-for channel_name, single_url in channels:
-    logging.info(f"Processing channel: {channel_name} URL: {single_url}")
+# Build the CSV row for a single schedule event
+def to_program(event):
+    return {
+        'eventId': event.get('eventId'),
+        'title': event.get('title'),
+        'description': event.get('description'),
+        'datetime': event.get('datetime'),
+        'eventStartMyt': event.get('eventStartMyt'),
+        'eventEndMyt': event.get('eventEndMyt'),
+        'duration': event.get('duration'),
+        'genre': event.get('genre'),
+        'subGenre': event.get('subGenre'),
+    }
+
+# Yield rows from an already-parsed schedule, one day at a time
+def iter_programs(schedule_data):
+    for date, events in schedule_data.items():
+        for event in events:
+            if 'eventId' in event:
+                yield to_program(event)
+
+# Wraps the raw response stream so the body hash is computed while it is parsed
+class HashingReader:
+    def __init__(self, raw, hasher):
+        self.raw = raw
+        self.hasher = hasher
+
+    def read(self, size=-1):
+        chunk = self.raw.read(size)
+        self.hasher.update(chunk)
+        return chunk
+
+# Yield rows straight off the wire: only one event object is held in memory at a time
+def iter_stream_programs(stream):
+    builder = None
+    item_prefix = None
+    # Floats rather than Decimal, so events hash the same as json.loads and json.dumps can serialize them
+    for prefix, event, value in ijson.parse(stream, use_float=True):
+        if builder is None:
+            if event == 'start_map' and SCHEDULE_ITEM_PREFIX.match(prefix):
+                builder = ijson.ObjectBuilder()
+                item_prefix = prefix
+                builder.event(event, value)
+            continue
+        builder.event(event, value)
+        if event == 'end_map' and prefix == item_prefix:
+            if 'eventId' in builder.value:
+                yield to_program(builder.value)
+            builder = None
+
+# Pass through rows that are new or differ from the cache, recording every event's hash
+def iter_changed_programs(programs, cached_events, current_events):
+    for program in programs:
+        key = str(program['eventId'])
+        digest = event_hash(program)
+        current_events[key] = digest
+        if cached_events.get(key) != digest:
+            yield program
+
+# Count rows as they flow through the pipeline
+def iter_counted(programs, counts, key):
+    for program in programs:
+        counts[key] += 1
+        yield program
+
+# Write rows to a per-channel daily CSV, opening the file only once the first row arrives.
+# Incremental reruns on the same day append to that day's file instead of replacing it;
+# fresh files are written to a .part file and moved into place once complete
+def write_csv(output_file, programs):
+    append = INCREMENTAL and os.path.exists(output_file)
+    write_path = output_file if append else output_file + ".part"
+    written = 0
+    csvfile = None
     try:
-        response = requests.get(single_url)
-        if response.status_code != 200:
-            logging.warning(f"Failed to fetch data for {channel_name} with status code {response.status_code}")
+        for program in programs:
+            if csvfile is None:
+                csvfile = open(write_path, 'a' if append else 'w', newline='', encoding='utf-8')
+                writer = csv.DictWriter(csvfile, fieldnames=FIELDNAMES)
+                if not append:
+                    writer.writeheader()
+            writer.writerow(program)
+            written += 1
+    except Exception:
+        if csvfile is not None:
+            csvfile.close()
+            if not append:
+                os.remove(write_path)
+        raise
+    if csvfile is not None:
+        csvfile.close()
+        if not append:
+            os.replace(write_path, output_file)
+    return written
+
+# Parse Astro's MYT timestamps ("YYYY-MM-DD HH:MM:SS[.f]", optionally with a "T")
+def parse_myt(value):
+    if not value:
+        return None
+    try:
+        return datetime.strptime(str(value).strip().replace('T', ' ')[:19], '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        return None
+
+# Parse durations given as "HH:MM:SS" or as a number of seconds
+def parse_duration(value):
+    if value is None or str(value).strip() == '':
+        return None
+    text = str(value).strip()
+    try:
+        if ':' in text:
+            seconds = 0
+            for part in text.split(':'):
+                seconds = seconds * 60 + int(float(part))
+        else:
+            seconds = int(float(text))
+    except ValueError:
+        return None
+    return timedelta(seconds=seconds)
+
+# Convert a CSV-shaped row into the typed columnar schema
+def to_typed_row(program):
+    row = {name: (None if program.get(name) is None else str(program.get(name))) for name in FIELDNAMES}
+    row['eventStartMyt'] = parse_myt(program.get('eventStartMyt'))
+    row['eventEndMyt'] = parse_myt(program.get('eventEndMyt'))
+    row['duration'] = parse_duration(program.get('duration'))
+    return row
+
+# Upsert rows into <store_dir>/date=YYYYMMDD/channel=<name>/, one file per partition.
+# Partitions are keyed on the event's own start date, so re-fetching an overlapping
+# week replaces rows in place. An event whose start moved to another day is removed
+# from the channel's other partitions within the fetched date range, so
+# (channel, eventId) stays unique there; older partitions are left untouched.
+def write_columnar(safe_channel_name, programs):
+    partitions = {}
+    fetched_dates = {}
+    for program in programs:
+        row = to_typed_row(program)
+        start = row['eventStartMyt']
+        event_date = start.strftime('%Y%m%d') if start else current_date
+        partitions.setdefault(event_date, []).append(row)
+        fetched_dates[row['eventId']] = event_date
+    if not partitions:
+        return 0
+
+    # Existing partitions of this channel inside the fetched range that may hold moved events
+    first_date, last_date = min(partitions), max(partitions)
+    stale_dates = []
+    if os.path.isdir(store_dir):
+        for entry in sorted(os.listdir(store_dir)):
+            event_date = entry[len("date="):]
+            if (entry.startswith("date=") and event_date not in partitions
+                    and first_date <= event_date <= last_date):
+                stale_dates.append(event_date)
+
+    written = 0
+    # Write the fetched partitions before pruning the old ones, so a crash leaves a duplicate rather than a gap
+    for event_date in list(partitions) + stale_dates:
+        rows = partitions.get(event_date, [])
+        partition_dir = os.path.join(store_dir, f"date={event_date}", f"channel={safe_channel_name}")
+        partition_file = os.path.join(partition_dir, f"part-0.{OUTPUT_FORMAT}")
+        if not rows and not os.path.exists(partition_file):
             continue
-        if not response.content:
-            logging.warning(f"Empty response content for {channel_name}")
+        os.makedirs(partition_dir, exist_ok=True)
+
+        merged = {}
+        moved = 0
+        if os.path.exists(partition_file):
+            for row in read_table(partition_file).to_pylist():
+                if fetched_dates.get(row['eventId'], event_date) != event_date:
+                    moved += 1
+                    continue
+                merged[row['eventId']] = row
+        for row in rows:
+            merged[row['eventId']] = row
+        if not rows and not moved:
             continue
-        try:
-            data = response.json()
-        except Exception as e:
-            logging.error(f"JSON decode error for {channel_name}: {e}")
-            logging.error(f"Response content: {response.text[:200]}")  # print first 200 chars
+        if moved:
+            logging.info(f"Removed {moved} rescheduled events from date={event_date}/channel={safe_channel_name}")
+
+        if not merged:
+            os.remove(partition_file)
             continue
+        table = pa.Table.from_pylist(list(merged.values()), schema=STORE_SCHEMA)
+        tmp_file = partition_file + ".part"
+        write_table(table, tmp_file)
+        os.replace(tmp_file, partition_file)
+        written += len(rows)
+    return written
+
+# Fetch data for one channel and write its own CSV
+def process_channel(channel_name, single_url):
+    logging.info(f"Processing channel: {channel_name} URL: {single_url}")
+
+    # Sanitize channel name for filename
+    safe_channel_name = sanitize_filename(channel_name)
+
+    # Send conditional request headers from the last successful fetch
+    headers = {}
+    cache = None
+    if INCREMENTAL:
+        cache = load_channel_cache(safe_channel_name, single_url)
+        if cache.get('etag'):
+            headers['If-None-Match'] = cache['etag']
+        if cache.get('last_modified'):
+            headers['If-Modified-Since'] = cache['last_modified']
+
+    try:
+        host_limiter.wait(single_url)
+        response = session.get(single_url, headers=headers, timeout=REQUEST_TIMEOUT, stream=STREAMING)
+        if INCREMENTAL and response.status_code == 304:
+            logging.info(f"Schedule not modified for {channel_name}, skipping")
+            response.close()
+            return
+        if response.status_code != 200:
+            logging.warning(f"Failed to fetch data for {channel_name} with status code {response.status_code}")
+            response.close()
+            return
+        if not STREAMING:
+            if not response.content:
+                logging.warning(f"Empty response content for {channel_name}")
+                return
+            content_hash = hashlib.sha256(response.content).hexdigest()
+            if INCREMENTAL and content_hash == cache.get('content_hash'):
+                # Servers without validators still let us skip parsing on an identical body
+                update_validators(cache, response)
+                save_channel_cache(safe_channel_name, cache)
+                logging.info(f"Schedule content unchanged for {channel_name}, skipping")
+                return
+            try:
+                data = response.json()
+            except Exception as e:
+                logging.error(f"JSON decode error for {channel_name}: {e}")
+                logging.error(f"Response content: {response.text[:200]}")  # print first 200 chars
+                return
     except Exception as e:
         logging.error(f"Exception occurred while fetching data for {channel_name}: {e}")
-        continue
+        return
 
-    # Prepare to extract relevant events for this channel
-    programs = []
+    # Build the row pipeline: source -> (incremental filter) -> CSV writer
+    counts = {'total': 0, 'changed': 0}
+    if STREAMING:
+        hasher = hashlib.sha256()
+        response.raw.decode_content = True
+        programs = iter_stream_programs(HashingReader(response.raw, hasher))
+    else:
+        # Navigate to the schedule inside the JSON
+        schedule_data = data.get('response', {}).get('schedule', {})
+        if not schedule_data:
+            logging.warning(f"No schedule data found for {channel_name}")
+            return
+        programs = iter_programs(schedule_data)
+    programs = iter_counted(programs, counts, 'total')
 
-    # Navigate to the schedule inside the JSON
-    schedule_data = data.get('response', {}).get('schedule', {})
-    if not schedule_data:
-        logging.warning(f"No schedule data found for {channel_name}")
-        continue
+    # Keep only events that are new or differ from the cached copy
+    current_events = {}
+    if INCREMENTAL:
+        programs = iter_changed_programs(programs, cache.get('events', {}), current_events)
+        programs = iter_counted(programs, counts, 'changed')
 
-    # Loop through each day's schedule
-    for date, events in schedule_data.items():
-        for event in events:
-            if 'eventId' in event:
-                programs.append({
-                    'eventId': event.get('eventId'),
-                    'title': event.get('title'),
-                    'description': event.get('description'),
-                    'datetime': event.get('datetime'),
-                    'eventStartMyt': event.get('eventStartMyt'),
-                    'eventEndMyt': event.get('eventEndMyt'),
-                    'duration': event.get('duration'),
-                    'genre': event.get('genre'),
-                    'subGenre': event.get('subGenre'),
-                })
-
-    if not programs:
+    # Write to CSV or to the columnar store
+    try:
+        if OUTPUT_FORMAT == 'csv':
+            # Define output filename with channel name and date inside the output directory
+            output_target = os.path.join(output_dir, f"{safe_channel_name}_{current_date}.csv")
+            written = write_csv(output_target, programs)
+        else:
+            output_target = store_dir
+            written = write_columnar(safe_channel_name, programs)
+    except Exception as e:
+        logging.error(f"Exception occurred while processing events for {channel_name}: {e}")
+        return
+    finally:
+        response.close()
+
+    if not counts['total']:
         logging.warning(f"No program events found for {channel_name}")
-        continue
+        return
 
-    # Sanitize channel name for filename
-    safe_channel_name = sanitize_filename(channel_name)
+    if INCREMENTAL:
+        logging.info(f"{counts['changed']} of {counts['total']} events new or changed for {channel_name}")
+    if written:
+        logging.info(f"✅ Successfully written {written} records to {output_target}")
 
-    # Define output filename with channel name and date inside the output directory
-    output_file = os.path.join(output_dir, f"{safe_channel_name}_{current_date}.csv")
+    # Only advance the cache once the rows are safely on disk
+    if INCREMENTAL:
+        cache['events'] = current_events
+        cache['content_hash'] = hasher.hexdigest() if STREAMING else content_hash
+        update_validators(cache, response)
+        try:
+            save_channel_cache(safe_channel_name, cache)
+        except Exception as e:
+            logging.error(f"Exception occurred while saving cache for {channel_name}: {e}")
 
-    # Write to CSV
-    try:
-        with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
-            fieldnames = ['eventId', 'title', 'description', 'datetime', 'eventStartMyt', 'eventEndMyt', 'duration', 'genre', 'subGenre']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-
-            writer.writeheader()
-            for program in programs:
-                writer.writerow(program)
-        logging.info(f"✅ Successfully written {len(programs)} records to {output_file}")
-    except Exception as e:
-        logging.error(f"Exception occurred while writing file for {channel_name}: {e}")
+# Fetch channels concurrently on a bounded worker pool (EPG_MAX_WORKERS=1 restores the serial run)
+with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+    futures = {executor.submit(process_channel, name, url): name for name, url in channels}
+    for future in as_completed(futures):
+        try:
+            future.result()
+        except Exception as e:
+            logging.error(f"Unhandled exception for {futures[future]}: {e}")
@@ -0,0 +1,215 @@
+import csv
+import glob
+import logging
+import os
+import re
+import math
+import unicodedata
+from collections import defaultdict
+from functools import lru_cache
+from datetime import datetime
+
+# Match settings (override via environment variables)
+WORKS_FILE = os.getenv('EPG_MATCH_WORKS', '')                                  # LocalDB_<date>.csv from local_DB.py
+EPG_INPUT = os.getenv('EPG_MATCH_INPUT', os.path.join('astro_channel_reports', '*.csv'))
+TOP_K = int(os.getenv('EPG_MATCH_TOP_K', '3'))                                 # Candidates kept per EPG row
+MIN_SCORE = float(os.getenv('EPG_MATCH_MIN_SCORE', '0.5'))                     # Drop candidates below this score
+MAX_POSTING = int(os.getenv('EPG_MATCH_MAX_POSTING', '5000'))                   # Skip trigrams shared by more titles than this
+CACHE_SIZE = int(os.getenv('EPG_MATCH_CACHE_SIZE', '100000'))                  # Distinct title/description pairs kept scored
+DESCRIPTION_WEIGHT = 0.8      # A title found inside a description counts a little less than a title match
+PERFORMER_BONUS = 0.1         # Added when the work's performer also appears in the EPG text
+MIN_CONTAINMENT_CHARS = 7     # Short work titles ("Love") are only matched against the EPG title
+
+# Directory to save match results
+output_dir = "epg_matches"
+os.makedirs(output_dir, exist_ok=True)
+
+# Directory to save logs
+log_dir = "log"
+os.makedirs(log_dir, exist_ok=True)
+
+log_filename = datetime.now().strftime("%d_%m_%Y") + ".log"
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler(os.path.join(log_dir, log_filename), encoding='utf-8'),
+        logging.StreamHandler()
+    ]
+)
+
+# Fold case, full-width forms and punctuation so "Lagu-Cinta!" and "ｌａｇｕ ｃｉｎｔａ" compare equal
+def normalize(text):
+    if not text:
+        return ''
+    text = unicodedata.normalize('NFKC', str(text)).lower()
+    text = re.sub(r'[^\w]+', ' ', text)
+    return ' '.join(text.split())
+
+# Distinct character trigrams of a normalized string, padded so short words still produce grams
+def trigrams(text):
+    if not text:
+        return set()
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class WorkIndex:
+    """Inverted trigram index over work titles; candidates come from posting lists, never a full scan.
+
+    Each title of a work (e_title, ot_title) is indexed and scored on its own and the work keeps
+    its best title score, so a Chinese ot_title does not dilute an exact e_title match.
+    Descriptions are matched through a separate phrase index keyed on each title's first word.
+    """
+    def __init__(self, max_posting):
+        self.works = []
+        self.performers = []
+        self.title_works = []
+        self.title_grams = []
+        self.postings = defaultdict(list)
+        self.phrases = defaultdict(list)
+        self.phrase_lengths = defaultdict(set)
+        self.max_posting = max_posting
+
+    def add(self, work, titles, performer):
+        normalized = list(dict.fromkeys(t for t in (normalize(title) for title in titles) if t))
+        if not normalized:
+            return
+        work_id = len(self.works)
+        self.works.append(work)
+        self.performers.append(normalize(performer))
+        for title in normalized:
+            grams = frozenset(trigrams(title))
+            title_id = len(self.title_works)
+            self.title_works.append(work_id)
+            self.title_grams.append(grams)
+            for gram in grams:
+                self.postings[gram].append(title_id)
+            if len(title) >= MIN_CONTAINMENT_CHARS:
+                words = title.split(' ')
+                self.phrases[title].append(title_id)
+                self.phrase_lengths[words[0]].add(len(words))
+
+    def freeze(self):
+        skipped = sum(1 for posting in self.postings.values() if len(posting) > self.max_posting)
+        logging.info(f"Indexed {len(self.works)} works ({len(self.title_works)} titles) over {len(self.postings)} trigrams, "
+                     f"{skipped} trigrams over the posting cap")
+
+    def title_candidates(self, grams, min_score):
+        """Titles that can still reach min_score, looked up through the rarest grams only (prefix filtering).
+
+        A Dice score of t needs at least t*|q|/(2-t) shared grams, so any such title must contain
+        one of the |q| - that + 1 rarest grams of the query; the common grams are never expanded.
+        """
+        if min_score <= 0:
+            required = 1
+        else:
+            required = max(1, math.ceil(min_score * len(grams) / (2 - min_score) - 1e-9))
+        ranked = sorted((len(self.postings[gram]), gram) for gram in grams if gram in self.postings)
+        candidates = set()
+        for size, gram in ranked[:len(grams) - required + 1]:
+            # Grams shared by a large part of the catalogue ("the", " la") carry no signal and dominate cost
+            if size > self.max_posting:
+                break
+            candidates.update(self.postings[gram])
+        return candidates
+
+    def match(self, title, description, top_k, min_score):
+        title_norm = normalize(title)
+        desc_norm = normalize(description)
+        title_grams = trigrams(title_norm)
+        scores = {}
+
+        # Dice similarity between EPG title and each work title; the work keeps its best title.
+        # The performer bonus can still lift a lower score over min_score
+        for title_id in self.title_candidates(title_grams, min_score - PERFORMER_BONUS):
+            work_id = self.title_works[title_id]
+            grams = self.title_grams[title_id]
+            score = 2.0 * len(title_grams & grams) / (len(title_grams) + len(grams))
+            if score > scores.get(work_id, 0):
+                scores[work_id] = score
+
+        # Work title appearing in the EPG description as whole words, in order
+        words = desc_norm.split(' ') if desc_norm else []
+        for start, word in enumerate(words):
+            for length in self.phrase_lengths.get(word, ()):
+                for title_id in self.phrases.get(' '.join(words[start:start + length]), ()):
+                    work_id = self.title_works[title_id]
+                    if DESCRIPTION_WEIGHT > scores.get(work_id, 0):
+                        scores[work_id] = DESCRIPTION_WEIGHT
+
+        text = f" {title_norm} {desc_norm} "
+        candidates = []
+        for work_id, score in scores.items():
+            performer = self.performers[work_id]
+            if performer and f" {performer} " in text:
+                score = min(1.0, score + PERFORMER_BONUS)
+            if score >= min_score:
+                candidates.append((score, work_id))
+        candidates.sort(key=lambda c: (-c[0], c[1]))
+        return [(round(score, 4), self.works[work_id]) for score, work_id in candidates[:top_k]]
+
+# Load the exported work catalogue (tab separated, all fields quoted); one entry per work
+def load_works(works_file, index):
+    seen = set()
+    with open(works_file, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f, delimiter='\t')
+        reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+        for row in reader:
+            key = (row.get('worknum'), row.get('worknum_society'))
+            # local_DB.py emits one row per right_type; the titles are the same
+            if key in seen:
+                continue
+            seen.add(key)
+            work = {
+                'worknum': row.get('worknum'),
+                'worknum_society': row.get('worknum_society'),
+                'e_title': row.get('e_title'),
+                'ot_title': row.get('ot_title'),
+                'performer': row.get('performer'),
+            }
+            index.add(work, [row.get('e_title'), row.get('ot_title')], row.get('performer'))
+    index.freeze()
+
+def main():
+    if not WORKS_FILE:
+        raise ValueError("EPG_MATCH_WORKS must point to a LocalDB_<date>.csv export")
+
+    index = WorkIndex(MAX_POSTING)
+    load_works(WORKS_FILE, index)
+
+    epg_files = sorted(glob.glob(EPG_INPUT))
+    logging.info(f"Found {len(epg_files)} EPG files to match.")
+
+    output_file = os.path.join(output_dir, f"epg_matches_{datetime.now().strftime('%Y%m%d')}.csv")
+    fieldnames = ['source_file', 'eventId', 'title', 'rank', 'score', 'worknum', 'worknum_society', 'e_title', 'ot_title', 'performer']
+
+    # EPG titles repeat heavily across days and channels; keep the most recent distinct title/description pairs scored
+    match = lru_cache(maxsize=CACHE_SIZE)(lambda title, description: index.match(title, description, TOP_K, MIN_SCORE))
+    rows_read = 0
+    rows_matched = 0
+    with open(output_file, 'w', newline='', encoding='utf-8') as out:
+        writer = csv.DictWriter(out, fieldnames=fieldnames)
+        writer.writeheader()
+        for epg_file in epg_files:
+            with open(epg_file, newline='', encoding='utf-8') as f:
+                for event in csv.DictReader(f):
+                    rows_read += 1
+                    candidates = match(event.get('title') or '', event.get('description') or '')
+                    if candidates:
+                        rows_matched += 1
+                    for rank, (score, work) in enumerate(candidates, start=1):
+                        writer.writerow({
+                            'source_file': os.path.basename(epg_file),
+                            'eventId': event.get('eventId'),
+                            'title': event.get('title'),
+                            'rank': rank,
+                            'score': score,
+                            **work,
+                        })
+
+    cache = match.cache_info()
+    logging.info(f"Matched {rows_matched} of {rows_read} EPG rows ({cache.misses} scored, {cache.hits} reused)")
+    logging.info(f"✅ Match results written to {output_file}")
+
+if __name__ == "__main__":
+    main()
@@ -17,6 +17,19 @@ import socket
 import platform
 from dotenv import load_dotenv
 import shutil
+import json
+import hashlib
+import shlex
+import errno
+import zlib
+import random
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 # Configuration
 load_dotenv()
@@ -36,6 +49,25 @@ MAX_RETRIES = 7                 # Increased retry attempts
 RETRY_BACKOFF = [5, 10, 30, 60, 120, 300, 600]  # Progressive delays
 KEEPALIVE_INTERVAL = 15         # Aggressive keepalives
 BUFFER_SIZE = 128 * 1024        # 128KB buffer size
+PIPELINE_DEPTH = int(os.getenv('PIPELINE_DEPTH', '32'))  # Outstanding SFTP read requests (0 = one read at a time)
+MANIFEST_CHUNK_SIZE = 8 * 1024 * 1024  # 8MB verification chunks in the .manifest sidecar
+END_TO_END_VERIFY = os.getenv('END_TO_END_VERIFY', '1') == '1'  # check-file / remote sha256sum after download
+PROGRESS_INTERVAL = 30          # Seconds between progress reports
+WATCHDOG_INTERVAL = 10          # Seconds between connection checks
+THROUGHPUT_WINDOW = 30          # Seconds of history behind the moving-average speed
+STALL_THRESHOLD = 5             # A single read slower than this counts as stalled time
+METRICS_FILE = Path(os.getenv('METRICS_FILE', '') or LOG_FILE.parent / 'sftp_metrics.jsonl')
+ADAPTIVE_TRANSFER = os.getenv('ADAPTIVE_TRANSFER', '0') == '1'  # Tune pipeline depth and compression per host/file
+TRANSFER_PROFILE = Path(os.getenv('TRANSFER_PROFILE', '') or LAST_FILE_RECORD.parent / 'transfer_profile.json')
+DEPTH_CANDIDATES = [8, 16, 32, 64, 128]  # Outstanding-request counts tried in adaptive mode
+TUNE_TRIAL_BYTES = 8 * 1024 * 1024       # Bytes measured per candidate pipeline depth
+COMPRESSED_EXTENSIONS = {'.gz', '.zip', '.bz2', '.xz', '.7z', '.zst', '.rar', '.tgz'}
+COMPRESSION_SAMPLE = 256 * 1024      # Bytes sampled to test compressibility
+COMPRESSION_RATIO = 0.9              # Negotiate zlib only if the sample shrinks below this ratio
+DELIVERY_MODE = os.getenv('DELIVERY_MODE', 'auto').lower()  # auto | move | tee
+FICLONE = 0x40049409                 # Linux reflink ioctl (btrfs, XFS, ...)
+BATCH_MODE = os.getenv('BATCH_MODE', '0') == '1'         # Catch up on every pending file over one connection
+BATCH_WORKERS = max(1, int(os.getenv('BATCH_WORKERS', '1')))  # Files downloaded at the same time in batch mode
 
 # Logging
 logging.basicConfig(
@@ -50,6 +82,293 @@ logger = logging.getLogger('sftp_downloader')
 paramiko_logger = logging.getLogger('paramiko')
 paramiko_logger.setLevel(logging.WARNING)
 
+class ChunkManifest:
+    """Sidecar <file>.manifest holding a sha256 per fixed-size chunk of a download.
+
+    A chunk is only recorded after its bytes have been flushed to disk, so every
+    entry describes data that is really on disk. Resume restarts at the end of
+    the last chunk that still hashes correctly instead of trusting the file size.
+    """
+    def __init__(self, local_path, file_size, chunk_size=MANIFEST_CHUNK_SIZE):
+        self.path = Path(str(local_path) + '.manifest')
+        self.file_size = file_size
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self._reset_hasher()
+
+    def _reset_hasher(self):
+        self.hasher = hashlib.sha256()
+        self.pending = 0
+
+    def load(self):
+        """Load chunk hashes if the sidecar describes the same remote file"""
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get('file_size') != self.file_size or data.get('chunk_size') != self.chunk_size:
+            logger.warning("Manifest does not match remote file, discarding it")
+            return False
+        self.chunks = list(data.get('chunks', []))
+        return True
+
+    def remove(self):
+        """Drop the sidecar once the file is verified and delivered; it only matters for resume"""
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not remove manifest {self.path}: {str(e)}")
+
+    def save(self):
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'file_size': self.file_size, 'chunk_size': self.chunk_size, 'chunks': self.chunks}, f)
+        os.replace(tmp_path, self.path)
+
+    def chunk_length(self, index):
+        return min(self.chunk_size, self.file_size - index * self.chunk_size)
+
+    def verified_length(self):
+        return min(len(self.chunks) * self.chunk_size, self.file_size)
+
+    def truncate(self, count):
+        """Forget chunks from index count onwards"""
+        del self.chunks[count:]
+        self._reset_hasher()
+
+    def update(self, data):
+        """Hash newly written bytes; returns True when at least one chunk was closed"""
+        closed = False
+        view = memoryview(data)
+        while view:
+            index = len(self.chunks)
+            take = min(len(view), self.chunk_length(index) - self.pending)
+            self.hasher.update(view[:take])
+            self.pending += take
+            view = view[take:]
+            if self.pending == self.chunk_length(index):
+                self.chunks.append(self.hasher.hexdigest())
+                self._reset_hasher()
+                closed = True
+        return closed
+
+def hash_file_range(path, offset, length):
+    """sha256 of a byte range of a local file"""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        remaining = length
+        while remaining > 0:
+            data = f.read(min(BUFFER_SIZE, remaining))
+            if not data:
+                break
+            hasher.update(data)
+            remaining -= len(data)
+    return hasher.hexdigest()
+
+_metrics_lock = threading.Lock()
+
+class TransferMetrics:
+    """Throughput, ETA and stall accounting for one file transfer.
+
+    Reports go to the log and, as JSON lines, to METRICS_FILE so pipeline
+    depth and compression can be tuned against real numbers.
+    """
+    def __init__(self, file_name, file_size, start_byte, reconnects):
+        self.file_name = file_name
+        self.file_size = file_size
+        self.start_byte = start_byte
+        self.reconnects = reconnects
+        self.pipeline_depth = PIPELINE_DEPTH
+        self.compression = None
+        self.start_time = time.monotonic()
+        self.last_report = self.start_time
+        self.bytes = 0
+        self.chunks = 0
+        self.stalled = 0.0
+        self.samples = deque([(self.start_time, 0)])
+
+    def record_chunk(self, nbytes, read_seconds):
+        now = time.monotonic()
+        self.bytes += nbytes
+        self.chunks += 1
+        if read_seconds >= STALL_THRESHOLD:
+            self.stalled += read_seconds
+        self.samples.append((now, self.bytes))
+        # Keep one sample just outside the window as the baseline
+        while len(self.samples) > 2 and self.samples[1][0] < now - THROUGHPUT_WINDOW:
+            self.samples.popleft()
+
+    def throughput(self):
+        (t0, b0), (t1, b1) = self.samples[0], self.samples[-1]
+        return (b1 - b0) / (t1 - t0) if t1 > t0 else 0.0
+
+    def snapshot(self, event):
+        elapsed = time.monotonic() - self.start_time
+        position = self.start_byte + self.bytes
+        speed = self.throughput()
+        remaining = max(self.file_size - position, 0)
+        return {
+            'ts': datetime.now().isoformat(timespec='seconds'),
+            'event': event,
+            'file': self.file_name,
+            'position': position,
+            'file_size': self.file_size,
+            'percent': round(position / self.file_size * 100, 2) if self.file_size else 100.0,
+            'throughput_bps': round(speed),
+            'avg_bps': round(self.bytes / elapsed) if elapsed > 0 else 0,
+            'eta_s': round(remaining / speed) if speed > 0 else None,
+            'elapsed_s': round(elapsed, 1),
+            'chunks': self.chunks,
+            'avg_chunk_bytes': round(self.bytes / self.chunks) if self.chunks else 0,
+            'stalled_s': round(self.stalled, 1),
+            'reconnects': self.reconnects,
+            'pipeline_depth': self.pipeline_depth,
+            'compression': self.compression,
+        }
+
+    def write(self, record):
+        try:
+            with _metrics_lock, open(METRICS_FILE, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+        except OSError as e:
+            logger.warning(f"Could not write metrics: {str(e)}")
+
+    def maybe_report(self):
+        if time.monotonic() - self.last_report < PROGRESS_INTERVAL:
+            return
+        self.last_report = time.monotonic()
+        record = self.snapshot('progress')
+        eta = f"{record['eta_s']}s" if record['eta_s'] is not None else "n/a"
+        logger.info(
+            f"Progress: {record['percent']:.1f}% | "
+            f"Speed: {record['throughput_bps']/1024:.1f}KB/s | "
+            f"ETA: {eta} | "
+            f"Position: {record['position']/1024/1024:.2f}MB | "
+            f"Stalled: {record['stalled_s']}s"
+        )
+        self.write(record)
+
+    def finish(self, event):
+        record = self.snapshot(event)
+        logger.info(
+            f"Transfer {event}: {self.bytes/1024/1024:.2f}MB in {record['elapsed_s']}s | "
+            f"Avg: {record['avg_bps']/1024:.1f}KB/s | "
+            f"Chunks: {record['chunks']} (avg {record['avg_chunk_bytes']/1024:.0f}KB) | "
+            f"Stalled: {record['stalled_s']}s | "
+            f"Reconnects: {record['reconnects']}"
+        )
+        self.write(record)
+
+_profile_lock = threading.Lock()
+
+def load_transfer_profile():
+    """Tuned transfer parameters persisted for SFTP_HOST by earlier runs"""
+    try:
+        with open(TRANSFER_PROFILE, 'r') as f:
+            return json.load(f).get(SFTP_HOST, {})
+    except (OSError, ValueError):
+        return {}
+
+def save_transfer_profile(**settings):
+    with _profile_lock:
+        try:
+            with open(TRANSFER_PROFILE, 'r') as f:
+                profiles = json.load(f)
+        except (OSError, ValueError):
+            profiles = {}
+        profile = profiles.setdefault(SFTP_HOST, {})
+        profile.update(settings)
+        profile['updated'] = datetime.now().isoformat(timespec='seconds')
+        tmp_path = TRANSFER_PROFILE.with_name(TRANSFER_PROFILE.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(profiles, f, indent=2)
+        os.replace(tmp_path, TRANSFER_PROFILE)
+
+class DepthTuner:
+    """Times the first megabytes of a transfer at each candidate pipeline depth and keeps the fastest.
+
+    paramiko splits reads into requests of at most 32KB, so throughput over a
+    high-latency link is set by how many requests are outstanding, not by the
+    read size. Each trial is a segment of the real download, so no extra bytes
+    are fetched. Files too small to run every trial keep the starting depth.
+    """
+    def __init__(self, remaining_bytes, start_depth):
+        self.current = start_depth
+        self.results = {}
+        self.trials = []
+        self.tuned = False
+        if ADAPTIVE_TRANSFER and start_depth > 0 and remaining_bytes >= 2 * TUNE_TRIAL_BYTES * len(DEPTH_CANDIDATES):
+            # Measure the last known best first so an aborted tuning run still uses it
+            self.trials = [start_depth] + [d for d in DEPTH_CANDIDATES if d != start_depth]
+
+    def segment(self, position, file_size):
+        """Pipeline depth and end offset of the next segment to download"""
+        if self.trials:
+            return self.trials[0], min(position + TUNE_TRIAL_BYTES, file_size)
+        return self.current, file_size
+
+    def record(self, depth, nbytes, seconds):
+        if not self.trials:
+            return
+        self.results[depth] = nbytes / seconds if seconds > 0 else float('inf')
+        self.trials.pop(0)
+        if self.trials:
+            return
+        self.current = max(self.results, key=self.results.get)
+        self.tuned = True
+        logger.info(
+            "Pipeline depth tuning: " +
+            ", ".join(f"{depth}={rate/1024:.0f}KB/s" for depth, rate in self.results.items()) +
+            f" -> using {self.current}"
+        )
+
+class VerificationError(IOError):
+    """Downloaded bytes did not match the remote file; the resume point has been reset"""
+
+# Failures worth a reconnect-and-resume rather than ending the run
+TRANSIENT_ERRORS = (EOFError, paramiko.SSHException, socket.timeout, socket.gaierror, ConnectionError, VerificationError)
+NETWORK_ERRNOS = {errno.ECONNRESET, errno.ECONNABORTED, errno.ECONNREFUSED, errno.ETIMEDOUT, errno.EPIPE,
+                  errno.ENETDOWN, errno.ENETUNREACH, errno.EHOSTUNREACH}
+
+def is_transient(error):
+    """True for network and verification failures; False for bad credentials or local disk errors"""
+    if isinstance(error, paramiko.AuthenticationException):
+        return False
+    if isinstance(error, TRANSIENT_ERRORS):
+        return True
+    # paramiko reports a dropped socket as a bare OSError without errno ("Socket is closed")
+    return isinstance(error, OSError) and (error.errno is None or error.errno in NETWORK_ERRNOS)
+
+class RetryScheduler:
+    """Exponential backoff with jitter over the MAX_RETRIES budget.
+
+    Delays follow RETRY_BACKOFF, each randomised to between half and all of the
+    step so parallel jobs do not reconnect in lock-step. A success calls reset().
+    """
+    def __init__(self, delays=RETRY_BACKOFF, max_retries=MAX_RETRIES):
+        self.delays = delays
+        self.max_retries = max_retries
+        self.attempt = 0
+
+    def reset(self):
+        self.attempt = 0
+
+    def wait(self, reason):
+        """Sleep before the next attempt; False once the budget is spent"""
+        if self.attempt >= self.max_retries:
+            logger.error(f"{reason} - retry budget of {self.max_retries} exhausted")
+            return False
+        base = self.delays[min(self.attempt, len(self.delays) - 1)]
+        delay = random.uniform(base / 2, base)
+        self.attempt += 1
+        logger.warning(f"{reason} - retry {self.attempt}/{self.max_retries} in {delay:.0f}s")
+        time.sleep(delay)
+        return True
+
 class MilitaryGradeSFTP:
     def __init__(self):
         self.transport = None
@@ -57,6 +376,23 @@ class MilitaryGradeSFTP:
         self.last_byte = 0
         self.file_size = 0
         self.retry_count = 0
+        self.owns_transport = True
+        self.mirrored = False
+        self.reconnects = 0  # reconnect() calls during the current file's download
+        self.profile = load_transfer_profile() if ADAPTIVE_TRANSFER else {}
+        self.compression = self.profile.get('compression', True)
+        self.pipeline_depth = self.profile.get('pipeline_depth', PIPELINE_DEPTH) if PIPELINE_DEPTH > 0 else 0
+
+    def spawn(self):
+        """Extra SFTP channel multiplexed over this engine's SSH transport"""
+        worker = MilitaryGradeSFTP()
+        worker.transport = self.transport
+        worker.owns_transport = False
+        worker.compression = self.compression
+        worker.pipeline_depth = self.pipeline_depth
+        worker.sftp = paramiko.SFTPClient.from_transport(self.transport)
+        worker.sftp.chdir(SFTP_DIR)
+        return worker
 
     def connect(self):
         """Establish ultra-reliable connection"""
@@ -65,7 +401,7 @@ class MilitaryGradeSFTP:
         # Connection hardening
         self.transport.window_size = 16 * 1024 * 1024  # 16MB window
         self.transport.packetizer.REKEY_BYTES = 512 * 1024 * 1024  # 512MB
-        self.transport.use_compression(True)
+        self.transport.use_compression(self.compression)
         self.transport.connect(username=SFTP_USER, password=SFTP_PASS)
         
         # Connection keepalive settings
@@ -88,6 +424,18 @@ class MilitaryGradeSFTP:
         else:
             logger.warning(f"Unknown platform {system_platform}, skipping TCP keepalive options")
 
+    def reconnect(self, scheduler):
+        """Tear down and re-establish the connection, backing off between failed attempts"""
+        self.reconnects += 1
+        while True:
+            self.close()
+            try:
+                self.connect()
+                return
+            except Exception as e:
+                if not is_transient(e) or not scheduler.wait(f"Reconnect failed: {str(e)}"):
+                    raise
+
     def close(self):
         """Secure connection teardown"""
         try:
@@ -96,7 +444,7 @@ class MilitaryGradeSFTP:
         except:
             pass
         try:
-            if self.transport:
+            if self.transport and self.owns_transport:
                 self.transport.close()
         except:
             pass
@@ -110,16 +458,155 @@ class MilitaryGradeSFTP:
         except:
             return False
 
-    def download_with_armor(self, remote_path, local_path):
-        """Ironclad download with military-grade reliability"""
+    def wants_compression(self, remote_path):
+        """Decide whether zlib is worth negotiating for this file"""
+        if Path(remote_path).suffix.lower() in COMPRESSED_EXTENSIONS:
+            return False
+        try:
+            with self.sftp.file(remote_path, 'rb') as remote_file:
+                sample = remote_file.read(COMPRESSION_SAMPLE)
+        except IOError as e:
+            logger.warning(f"Compressibility sample failed ({str(e)}), keeping current setting")
+            return self.compression
+        if not sample:
+            return self.compression
+        ratio = len(zlib.compress(sample, 1)) / len(sample)
+        logger.info(f"Compressibility sample ratio: {ratio:.2f}")
+        return ratio < COMPRESSION_RATIO
+
+    def prepare_compression(self, remote_path):
+        """Reconnect with compression switched when the file calls for it (adaptive mode)"""
+        if not ADAPTIVE_TRANSFER:
+            return
+        want = self.wants_compression(remote_path)
+        if want != self.compression:
+            if not self.owns_transport:
+                logger.info("Compression change skipped on shared transport")
+                return
+            logger.info(f"Reconnecting with compression {'on' if want else 'off'}")
+            self.close()
+            self.compression = want
+            self.connect()
+        save_transfer_profile(compression=want)
+
+    def prepare_resume(self, local_path, manifest):
+        """Work out a verified resume offset and truncate anything past it"""
+        if not os.path.exists(local_path):
+            return 0
+        local_size = os.path.getsize(local_path)
+
+        if manifest.load():
+            # Ignore entries for bytes that never made it to disk
+            manifest.truncate(min(len(manifest.chunks), local_size // manifest.chunk_size
+                                  + (1 if local_size == self.file_size else 0)))
+            # A torn write shows up in the most recent chunks; walk back until one verifies
+            while manifest.chunks:
+                index = len(manifest.chunks) - 1
+                offset = index * manifest.chunk_size
+                if hash_file_range(local_path, offset, manifest.chunk_length(index)) == manifest.chunks[index]:
+                    break
+                logger.warning(f"Chunk {index} at offset {offset} failed verification, re-fetching it")
+                manifest.truncate(index)
+        else:
+            # No sidecar (older partial download): hash the complete chunks already on disk
+            logger.info("No manifest found, building one from the partial file")
+            for index in range(local_size // manifest.chunk_size):
+                manifest.chunks.append(hash_file_range(local_path, index * manifest.chunk_size, manifest.chunk_size))
+            if local_size == self.file_size and local_size % manifest.chunk_size:
+                index = len(manifest.chunks)
+                manifest.chunks.append(hash_file_range(local_path, index * manifest.chunk_size, manifest.chunk_length(index)))
+
+        resume_at = manifest.verified_length()
+        if resume_at < local_size:
+            with open(local_path, 'r+b') as f:
+                f.truncate(resume_at)
+            logger.info(f"Truncated unverified tail: {local_size - resume_at} bytes")
+        manifest.save()
+        return resume_at
+
+    def verify_end_to_end(self, remote_file, remote_path, local_path, manifest):
+        """Compare against server-side hashes when the server can provide them"""
+        # Preferred: SFTP check-file extension, one hash per manifest chunk
+        try:
+            remote_hashes = remote_file.check('sha256', 0, 0, manifest.chunk_size)
+        except (IOError, paramiko.SSHException) as e:
+            logger.info(f"check-file not supported by server ({str(e)}), trying sha256sum")
+        else:
+            local_hashes = b''.join(bytes.fromhex(h) for h in manifest.chunks)
+            if remote_hashes == local_hashes:
+                logger.info("End-to-end check-file verification passed")
+                return
+            digest_size = hashlib.sha256().digest_size
+            for index in range(len(manifest.chunks)):
+                if remote_hashes[index * digest_size:(index + 1) * digest_size] != local_hashes[index * digest_size:(index + 1) * digest_size]:
+                    break
+            # Keep the good prefix so the retry only re-fetches from the first bad chunk
+            manifest.truncate(index)
+            manifest.save()
+            with open(local_path, 'r+b') as f:
+                f.truncate(manifest.verified_length())
+            self.last_byte = manifest.verified_length()
+            raise VerificationError(f"check-file mismatch at chunk {index}, truncated to {self.last_byte} bytes")
+
+        # Fallback: whole-file sha256sum on the server
+        try:
+            channel = self.transport.open_session()
+            channel.exec_command(f"sha256sum {shlex.quote(remote_path)}")
+            output = channel.makefile('r').read().strip()
+            status = channel.recv_exit_status()
+            channel.close()
+        except paramiko.SSHException as e:
+            logger.info(f"Remote sha256sum unavailable ({str(e)}), relying on chunk manifest and size")
+            return
+        if status != 0 or not output:
+            logger.info("Remote sha256sum unavailable, relying on chunk manifest and size")
+            return
+        remote_digest = output.split()[0].lower()
+        if hash_file_range(local_path, 0, self.file_size) != remote_digest:
+            # Cannot localise the damage: start this file over
+            manifest.truncate(0)
+            manifest.save()
+            with open(local_path, 'r+b') as f:
+                f.truncate(0)
+            self.last_byte = 0
+            raise VerificationError("Remote sha256sum mismatch, file reset for re-download")
+        logger.info("End-to-end sha256sum verification passed")
+
+    def open_mirror(self, mirror_path):
+        """Open <mirror>.part positioned at the resume point, or None if it cannot follow"""
+        part_path = Path(str(mirror_path) + '.part')
+        try:
+            os.makedirs(part_path.parent, exist_ok=True)
+            if self.last_byte == 0:
+                return open(part_path, 'wb')
+            if part_path.exists() and os.path.getsize(part_path) >= self.last_byte:
+                mirror = open(part_path, 'r+b')
+                mirror.truncate(self.last_byte)
+                mirror.seek(self.last_byte)
+                return mirror
+            logger.info("Mirror copy is behind the resume point, delivering after download instead")
+        except OSError as e:
+            logger.warning(f"Cannot stream to {part_path}: {str(e)}")
+        return None
+
+    def download_with_armor(self, remote_path, local_path, mirror_path=None):
+        """Ironclad download with military-grade reliability.
+
+        With mirror_path set, every chunk is also written to <mirror_path>.part,
+        which is renamed into place once the download verifies (self.mirrored).
+        """
+        metrics = None
+        mirror = None
+        self.mirrored = False
         try:
             # Get file info
             self.file_size = self.sftp.stat(remote_path).st_size
             logger.info(f"Target file size: {self.file_size/1024/1024:.2f}MB")
             
-            # Resume logic
-            self.last_byte = os.path.getsize(local_path) if os.path.exists(local_path) else 0
-            mode = 'ab' if self.last_byte > 0 else 'wb'
+            # Resume logic: restart after the last chunk that still verifies
+            manifest = ChunkManifest(local_path, self.file_size)
+            self.last_byte = self.prepare_resume(local_path, manifest)
+            mode = 'r+b' if self.last_byte > 0 else 'wb'
             
             if self.last_byte >= self.file_size:
                 logger.info("File already complete")
@@ -127,52 +614,282 @@ class MilitaryGradeSFTP:
 
             logger.info(f"Resume point: {self.last_byte} bytes ({self.last_byte/1024/1024:.2f}MB)")
 
-            with self.sftp.file(remote_path, 'rb') as remote_file:
-                if self.last_byte > 0:
-                    remote_file.seek(self.last_byte)
-                
-                with open(local_path, mode) as local_file:
-                    while self.last_byte < self.file_size:
-                        # Connection watchdog
-                        if time.time() % 10 == 0 and not self.verify_connection():
-                            raise paramiko.SSHException("Connection watchdog triggered")
-                        
-                        try:
-                            chunk = remote_file.read(CHUNK_SIZE)
-                            if not chunk:
-                                break
-                                
-                            local_file.write(chunk)
-                            self.last_byte += len(chunk)
-                            
-                            # Progress reporting
-                            if time.time() % 30 == 0:
-                                percent = (self.last_byte / self.file_size) * 100
-                                speed = len(chunk) / (time.time() % 30)
-                                logger.info(
-                                    f"Progress: {percent:.1f}% | "
-                                    f"Speed: {speed/1024:.1f}KB/s | "
-                                    f"Position: {self.last_byte/1024/1024:.2f}MB"
-                                )
-                                
-                        except (paramiko.SSHException, EOFError) as e:
-                            logger.warning(f"Chunk transfer failed: {str(e)}")
-                            raise
+            metrics = TransferMetrics(Path(remote_path).name, self.file_size, self.last_byte,
+                                      self.reconnects)
+            metrics.compression = self.compression
+            last_watchdog = time.monotonic()
+            if mirror_path is not None:
+                mirror = self.open_mirror(mirror_path)
+
+            tuner = DepthTuner(self.file_size - self.last_byte, self.pipeline_depth)
+            with open(local_path, mode) as local_file:
+                local_file.seek(self.last_byte)
+                while self.last_byte < self.file_size:
+                    # Each tuning trial gets its own handle, since prefetch is set once per handle
+                    depth, segment_end = tuner.segment(self.last_byte, self.file_size)
+                    metrics.pipeline_depth = depth
+                    segment_bytes = 0
+                    segment_time = 0.0
+                    with self.sftp.file(remote_path, 'rb') as remote_file:
+                        if self.last_byte > 0:
+                            remote_file.seek(self.last_byte)
+
+                        # Pipelined mode: queue async reads up to the segment end from the
+                        # resume point so each chunk no longer waits a full round-trip
+                        if depth > 0:
+                            remote_file.prefetch(segment_end, max_concurrent_requests=depth)
+                            if segment_end == self.file_size:
+                                logger.info(f"Pipelined download with {depth} outstanding requests")
+
+                        while self.last_byte < segment_end:
+                            # Connection watchdog
+                            if time.monotonic() - last_watchdog >= WATCHDOG_INTERVAL:
+                                last_watchdog = time.monotonic()
+                                if not self.verify_connection():
+                                    raise paramiko.SSHException("Connection watchdog triggered")
+
+                            try:
+                                read_start = time.monotonic()
+                                chunk = remote_file.read(min(CHUNK_SIZE, segment_end - self.last_byte))
+                                if not chunk:
+                                    break
+                                read_seconds = time.monotonic() - read_start
+                                metrics.record_chunk(len(chunk), read_seconds)
+                                segment_bytes += len(chunk)
+                                segment_time += read_seconds
+
+                                local_file.write(chunk)
+                                if mirror:
+                                    mirror.write(chunk)
+                                self.last_byte += len(chunk)
+
+                                # Record finished chunks only once their bytes are on disk
+                                if manifest.update(chunk):
+                                    local_file.flush()
+                                    os.fsync(local_file.fileno())
+                                    manifest.save()
+
+                                # Progress reporting
+                                metrics.maybe_report()
+
+                            except (paramiko.SSHException, EOFError) as e:
+                                logger.warning(f"Chunk transfer failed: {str(e)}")
+                                raise
+                    if self.last_byte < segment_end:
+                        # Remote file ended early; the size check below reports it
+                        break
+                    tuner.record(depth, segment_bytes, segment_time)
+
+            if END_TO_END_VERIFY and self.last_byte >= self.file_size:
+                with self.sftp.file(remote_path, 'rb') as remote_file:
+                    self.verify_end_to_end(remote_file, remote_path, local_path, manifest)
 
             # Final verification
             if os.path.getsize(local_path) == self.file_size:
                 logger.info("Download fully verified")
+                metrics.finish('complete')
+                if mirror:
+                    mirror.close()
+                    os.replace(str(mirror_path) + '.part', mirror_path)
+                    self.mirrored = True
+                    logger.info(f"Streamed copy delivered to {mirror_path}")
+                if tuner.tuned:
+                    self.pipeline_depth = tuner.current
+                    save_transfer_profile(pipeline_depth=tuner.current)
                 return True
                 
-            raise IOError("Final size verification failed")
+            raise VerificationError("Final size verification failed")
 
         except Exception as e:
             logger.error(f"Transfer failed at {self.last_byte} bytes: {str(e)}")
+            if metrics:
+                metrics.finish('failed')
             raise
+        finally:
+            # Keep the .part mirror so a retry can continue it
+            if mirror and not mirror.closed:
+                mirror.close()
+
+def download_with_retry(engine, remote_path, local_path, scheduler, can_reconnect=True):
+    """Download a file, reconnecting and resuming mid-file on transient failures.
+
+    can_reconnect=False (any worker of a multi-worker batch) re-raises instead, since
+    reconnecting would close the SSH transport the other workers are using.
+    """
+    mirror_path = SERVER_DIR / Path(remote_path).name if DELIVERY_MODE == 'tee' else None
+    engine.reconnects = 0
+    while True:
+        try:
+            result = engine.download_with_armor(remote_path, local_path, mirror_path)
+            scheduler.reset()
+            return result
+        except Exception as e:
+            if not is_transient(e):
+                raise
+            # Workers on a shared transport cannot reconnect it; let the batch retry instead
+            if not can_reconnect or not engine.owns_transport:
+                raise
+            if not scheduler.wait(f"Transfer interrupted at {engine.last_byte} bytes: {str(e)}"):
+                raise
+            engine.reconnect(scheduler)
+
+def record_last_file(file_name):
+    """Advance the last_file.txt checkpoint"""
+    with open(LAST_FILE_RECORD, 'w') as f:
+        f.write(file_name)
+    logger.info(f"Downloaded and updated last file to {file_name}")
+
+_delivery_pool = ThreadPoolExecutor(max_workers=1)
+
+def fast_handoff(local_path, dest_path):
+    """Deliver without copying data: rename (move mode), hard link or reflink. Returns the method used"""
+    tmp_path = Path(str(dest_path) + '.part')
+    if DELIVERY_MODE == 'move':
+        try:
+            os.replace(local_path, dest_path)
+            return 'rename'
+        except OSError as e:
+            logger.info(f"Rename not possible ({str(e)}), falling back to link/copy")
+            if not os.path.exists(local_path):
+                raise
+    try:
+        if tmp_path.exists():
+            tmp_path.unlink()
+        os.link(local_path, tmp_path)
+        os.replace(tmp_path, dest_path)
+        return 'hard link'
+    except OSError:
+        pass
+    if fcntl is not None:
+        try:
+            with open(local_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            shutil.copystat(local_path, tmp_path)
+            os.replace(tmp_path, dest_path)
+            return 'reflink'
+        except OSError:
+            if tmp_path.exists():
+                tmp_path.unlink()
+    return None
+
+def kernel_copy(local_path, dest_path):
+    """Copy through the kernel (copy_file_range, then sendfile) into a .part file, then rename"""
+    tmp_path = Path(str(dest_path) + '.part')
+    with open(local_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+        size = os.fstat(src.fileno()).st_size
+        copied = 0
+        if hasattr(os, 'copy_file_range'):
+            try:
+                while copied < size:
+                    sent = os.copy_file_range(src.fileno(), dst.fileno(), size - copied, copied, copied)
+                    if sent == 0:
+                        break
+                    copied += sent
+            except OSError:
+                pass
+        if copied < size and hasattr(os, 'sendfile'):
+            try:
+                dst.seek(copied)
+                while copied < size:
+                    sent = os.sendfile(dst.fileno(), src.fileno(), copied, size - copied)
+                    if sent == 0:
+                        break
+                    copied += sent
+            except OSError:
+                pass
+        if copied < size:
+            src.seek(copied)
+            dst.seek(copied)
+            shutil.copyfileobj(src, dst, BUFFER_SIZE * 8)
+    shutil.copystat(local_path, tmp_path)
+    os.replace(tmp_path, dest_path)
+
+def background_copy(local_path, dest_path, file_name):
+    try:
+        kernel_copy(local_path, dest_path)
+        logger.info(f"Synced {file_name} to server directory {SERVER_DIR} (kernel copy)")
+    except Exception as e:
+        logger.error(f"Failed to sync to server directory: {str(e)}")
+
+def sync_to_server(local_path, file_name):
+    """Hand a finished download to the server directory.
+
+    Tries a zero-copy handoff first; otherwise queues a kernel-side copy in the
+    background so the next file can start downloading straight away.
+    """
+    try:
+        os.makedirs(SERVER_DIR, exist_ok=True)
+        dest_path = SERVER_DIR / file_name
+        method = fast_handoff(local_path, dest_path)
+        if method:
+            logger.info(f"Synced {file_name} to server directory {SERVER_DIR} ({method})")
+            return
+        _delivery_pool.submit(background_copy, local_path, dest_path, file_name)
+        logger.info(f"Queued background copy of {file_name} to {SERVER_DIR}")
+    except Exception as e:
+        logger.error(f"Failed to sync to server directory: {str(e)}")
+
+def download_batch(engine, pending_files, scheduler):
+    """Download every pending file over one connection, checkpointing in date order.
+
+    With BATCH_WORKERS > 1 several files transfer at once on separate SFTP
+    channels of the same transport. The checkpoint only ever advances past a
+    file once it and every earlier file have completed, so a failure leaves
+    last_file.txt pointing at the last contiguous success.
+    """
+    os.makedirs(LOCAL_DIR, exist_ok=True)
+    workers = [engine] + [engine.spawn() for _ in range(min(BATCH_WORKERS, len(pending_files)) - 1)]
+    idle = list(workers)
+
+    def fetch(remote_file):
+        worker = idle.pop()
+        try:
+            logger.info(f"Downloading {remote_file}")
+            # Compression is per transport, so it can only follow each file with a single worker
+            if len(workers) == 1:
+                worker.prepare_compression(f"{SFTP_DIR}/{remote_file}")
+            ok = download_with_retry(worker, f"{SFTP_DIR}/{remote_file}", LOCAL_DIR / remote_file, scheduler,
+                                     can_reconnect=len(workers) == 1)
+            return ok, worker.mirrored
+        finally:
+            idle.append(worker)
+
+    completed = 0
+    try:
+        with ThreadPoolExecutor(max_workers=len(workers)) as executor:
+            futures = [(name, executor.submit(fetch, name)) for name in pending_files]
+            for remote_file, future in futures:
+                try:
+                    ok, mirrored = future.result()
+                except Exception as e:
+                    logger.error(f"Batch download of {remote_file} failed: {str(e)}")
+                    if not is_transient(e):
+                        # Bad credentials or a local disk error: retrying the batch cannot help
+                        for _, pending in futures:
+                            pending.cancel()
+                        raise
+                    ok = False
+                if not ok:
+                    logger.error("Stopping checkpoint at first failed file")
+                    for _, pending in futures:
+                        pending.cancel()
+                    break
+                record_last_file(remote_file)
+                if not mirrored:
+                    sync_to_server(LOCAL_DIR / remote_file, remote_file)
+                ChunkManifest(LOCAL_DIR / remote_file, 0).remove()
+                completed += 1
+    finally:
+        for worker in workers[1:]:
+            worker.close()
+
+    logger.info(f"Batch complete: {completed}/{len(pending_files)} files")
+    return completed == len(pending_files)
 
 def main():
     logger.info("=== MILITARY-GRADE SFTP DOWNLOADER ===")
     engine = MilitaryGradeSFTP()
+    scheduler = RetryScheduler()
     last_error = None
 
     def extract_date(file_name):
@@ -220,26 +937,37 @@ def main():
                 logger.info("No new files to download after last_file.txt date")
                 break
 
+            # Catch-up mode: one listing, one connection, every pending file in date order
+            if BATCH_MODE:
+                # Stop at yesterday like the single-file loop: today's file may still be uploading
+                pending_files = sorted((f for f in filtered_files if extract_date(f) <= yesterday_str),
+                                       key=lambda x: extract_date(x))
+                if not pending_files:
+                    logger.info(f"No files up to {yesterday_str} pending after last_file.txt date")
+                    break
+                logger.info(f"Batch mode: {len(pending_files)} files pending after {last_date_str}")
+                if download_batch(engine, pending_files, scheduler):
+                    break
+                # Reconnect and pick up the remaining files from the checkpoint
+                if not scheduler.wait("Batch incomplete"):
+                    break
+                continue
+
             # Select earliest file after last_date_str
             remote_file = min(filtered_files, key=lambda x: extract_date(x))
             remote_path = f"{SFTP_DIR}/{remote_file}"
             local_path = LOCAL_DIR / remote_file
 
             os.makedirs(LOCAL_DIR, exist_ok=True)
+            engine.prepare_compression(remote_path)
 
-            if engine.download_with_armor(remote_path, local_path):
+            if download_with_retry(engine, remote_path, local_path, scheduler):
                 # Update last downloaded file record
-                with open(LAST_FILE_RECORD, 'w') as f:
-                    f.write(remote_file)
-                logger.info(f"Downloaded and updated last file to {remote_file}")
-                # Sync to server directory
-                try:
-                    os.makedirs(SERVER_DIR, exist_ok=True)
-                    dest_path = SERVER_DIR / remote_file
-                    shutil.copy2(local_path, dest_path)
-                    logger.info(f"Synced {remote_file} to server directory {SERVER_DIR}")
-                except Exception as e:
-                    logger.error(f"Failed to sync to server directory: {str(e)}")
+                record_last_file(remote_file)
+                # Sync to server directory (already there if streamed in tee mode)
+                if not engine.mirrored:
+                    sync_to_server(local_path, remote_file)
+                ChunkManifest(local_path, 0).remove()
             else:
                 logger.error("Download failed, stopping loop")
                 break
@@ -250,11 +978,13 @@ def main():
         except Exception as e:
             last_error = str(e)
             logger.error(f"Download cycle failed: {last_error}")
-            # Optional: add retry/backoff logic here if desired
-            break
+            if not is_transient(e) or not scheduler.wait("Download cycle failed"):
+                break
         finally:
             engine.close()
 
+    # Let queued background copies to SERVER_DIR finish before exiting
+    _delivery_pool.shutdown(wait=True)
     logger.info("Download loop ended")
 
 if __name__ == "__main__":
@@ -6,6 +6,13 @@ from urllib.parse import quote
 
 import base64
 import os
+import sqlite3
+import json
+from difflib import SequenceMatcher
+import unicodedata
+import re
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeout
+from requests.adapters import HTTPAdapter
 
 # Spotify API credentials - you need to set these environment variables or replace with your client id and secret
 SPOTIFY_CLIENT_ID = os.getenv('SPOTIFY_CLIENT_ID', '')
@@ -17,6 +24,65 @@ SPOTIFY_STATIC_TOKEN = ''
 import threading
 import time
 
+# Lookup concurrency and rate limiting (override via environment variables)
+MAX_WORKERS = max(1, int(os.getenv('SPOTIFY_MAX_WORKERS', '8')))  # Concurrent lookups
+RATE_LIMIT = float(os.getenv('SPOTIFY_RATE_LIMIT', '10'))        # Sustained requests per second
+RATE_BURST = int(os.getenv('SPOTIFY_RATE_BURST', '10'))          # Requests allowed back-to-back
+MAX_429_RETRIES = 5                                              # Retries of one request after HTTP 429
+
+class TokenBucket:
+    """Token-bucket rate limiter shared by all lookup threads.
+
+    A 429 from Spotify pauses the whole bucket for the Retry-After period so
+    every thread backs off, not just the one that was throttled.
+    """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+_rate_limiter = TokenBucket(RATE_LIMIT, RATE_BURST)
+
+# Shared pooled session for search requests
+_session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS)
+_session.mount('https://', _adapter)
+
+def spotify_get(url, headers):
+    """Rate-limited GET that honours Retry-After on HTTP 429"""
+    for attempt in range(MAX_429_RETRIES + 1):
+        _rate_limiter.acquire()
+        response = _session.get(url, headers=headers, timeout=30)
+        if response.status_code != 429 or attempt == MAX_429_RETRIES:
+            return response
+        retry_after = float(response.headers.get('Retry-After', 1))
+        print(f"Rate limited by Spotify, pausing {retry_after:.0f}s")
+        _rate_limiter.pause(retry_after)
+    return response
+
 _token_lock = threading.Lock()
 _token_cache = {
     'token': None,
@@ -60,7 +126,7 @@ def get_spotify_token():
             print(f"Error obtaining Spotify token: {str(e)}")
             return None
 
-def get_isrc(song_title, artist):
+def get_isrc(song_title, artist, query=None):
     if pd.isna(song_title) or pd.isna(artist) or not str(song_title).strip() or not str(artist).strip():
         return 'Missing Data'
         
@@ -68,7 +134,9 @@ def get_isrc(song_title, artist):
     search_title = str(song_title).strip() if not pd.isna(song_title) else str(artist).strip()
     search_artist = str(artist).strip()
     
-    query = f"track:{search_title} artist:{search_artist}"
+    # process_song_table builds queries for the whole table up front
+    if query is None:
+        query = f"track:{search_title} artist:{search_artist}"
     url = f"https://api.spotify.com/v1/search?q={quote(query)}&type=track&limit=1"
     
     token = get_spotify_token()
@@ -79,7 +147,7 @@ def get_isrc(song_title, artist):
     headers = {'Authorization': f'Bearer {token}'}
     
     try:
-        response = requests.get(url, headers=headers)
+        response = spotify_get(url, headers)
         response.raise_for_status()
         
         tracks = response.json().get('tracks', {}).get('items', [])
@@ -91,6 +159,242 @@ def get_isrc(song_title, artist):
         print(f"Error searching for {search_title} by {search_artist}: {str(e)}")
         return 'API Error'
 
+# Multi-candidate mode (SPOTIFY_CANDIDATES > 1): fetch several tracks per search and score them locally
+SPOTIFY_CANDIDATES = min(50, max(1, int(os.getenv('SPOTIFY_CANDIDATES', '1'))))
+MIN_MATCH_SCORE = float(os.getenv('SPOTIFY_MIN_MATCH_SCORE', '0.6'))
+TRACKS_BATCH = 50          # Spotify's limit for /v1/tracks?ids=
+TRACKS_BATCH_WAIT = 0.5    # Seconds a lookup waits for its batch to fill before sending it
+
+def search_tracks(query, limit):
+    """Raw search returning the candidate track objects"""
+    token = get_spotify_token()
+    if not token:
+        raise requests.exceptions.RequestException('Failed to obtain Spotify token')
+    url = f"https://api.spotify.com/v1/search?q={quote(query)}&type=track&limit={limit}"
+    response = spotify_get(url, {'Authorization': f'Bearer {token}'})
+    response.raise_for_status()
+    return response.json().get('tracks', {}).get('items', [])
+
+def similarity(a, b):
+    a, b = normalize_key(a), normalize_key(b)
+    if not a or not b:
+        return 0.0
+    return SequenceMatcher(None, a, b).ratio()
+
+def contains_artist(artist, name):
+    """True when name's words appear whole and in order in artist, e.g. 'Jay Chou' in 'Jay Chou / JJ Lin'"""
+    haystack = re.findall(r'\w+', normalize_key(artist))
+    needle = re.findall(r'\w+', normalize_key(name))
+    if not needle:
+        return False
+    return any(haystack[i:i + len(needle)] == needle for i in range(len(haystack) - len(needle) + 1))
+
+def score_track(track, titles, artist, duration):
+    """Weighted title/artist/duration similarity of a candidate track, 0..1"""
+    title_score = max(similarity(track.get('name', ''), title) for title in titles)
+    names = [a.get('name', '') for a in track.get('artists', [])]
+    artist_score = max([similarity(name, artist) for name in names] +
+                       [1.0 for name in names if contains_artist(artist, name)] + [0.0])
+    if duration and track.get('duration_ms'):
+        duration_score = max(0.0, 1 - abs(track['duration_ms'] / 1000 - duration) / 30)
+        return 0.55 * title_score + 0.3 * artist_score + 0.15 * duration_score
+    return 0.65 * title_score + 0.35 * artist_score
+
+class TrackBatcher:
+    """Resolves ISRCs for track IDs from concurrent lookups with one /v1/tracks call per 50 IDs"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queue = {}
+
+    def isrc_for(self, track_id):
+        with self.lock:
+            future = self.queue.get(track_id)
+            if future is None:
+                future = self.queue[track_id] = Future()
+            full = len(self.queue) >= TRACKS_BATCH
+        if full:
+            self.flush()
+        try:
+            return future.result(timeout=TRACKS_BATCH_WAIT)
+        except FutureTimeout:
+            # Nobody filled the batch in time; send whatever is queued
+            self.flush()
+            return future.result()
+
+    def flush(self):
+        with self.lock:
+            batch, self.queue = self.queue, {}
+        if not batch:
+            return
+        found = {}
+        try:
+            token = get_spotify_token()
+            if not token:
+                raise requests.exceptions.RequestException('Failed to obtain Spotify token')
+            url = f"https://api.spotify.com/v1/tracks?ids={','.join(batch)}"
+            response = spotify_get(url, {'Authorization': f'Bearer {token}'})
+            response.raise_for_status()
+            for track in response.json().get('tracks', []):
+                if track:
+                    found[track['id']] = track.get('external_ids', {}).get('isrc', 'No ISRC Found')
+        except requests.exceptions.RequestException as e:
+            print(f"Error fetching tracks batch: {str(e)}")
+            for future in batch.values():
+                future.set_result('API Error')
+            return
+        for track_id, future in batch.items():
+            future.set_result(found.get(track_id, 'No ISRC Found'))
+
+_track_batcher = TrackBatcher()
+
+def get_isrc_scored(song_title, artist, alt_title=None, duration=None):
+    """Pick the best of several search candidates instead of trusting the first hit.
+
+    Candidates are scored against both the English and Chinese titles, so the
+    c_title fallback usually needs no extra search. A second search with the
+    alternate title is sent only if nothing from the first scores well enough.
+    """
+    titles = [t for t in (song_title, alt_title) if t and not pd.isna(t)]
+    try:
+        candidates = search_tracks(f"track:{song_title} artist:{artist}", SPOTIFY_CANDIDATES)
+        best_score, best = max(((score_track(t, titles, artist, duration), t) for t in candidates),
+                               key=lambda c: c[0], default=(0.0, None))
+        if best_score < MIN_MATCH_SCORE and len(titles) > 1:
+            for track in search_tracks(f"track:{alt_title} artist:{artist}", SPOTIFY_CANDIDATES):
+                score = score_track(track, titles, artist, duration)
+                if score > best_score:
+                    best_score, best = score, track
+    except requests.exceptions.RequestException as e:
+        print(f"Error searching for {song_title} by {artist}: {str(e)}")
+        return 'API Error'
+
+    if best is None or best_score < MIN_MATCH_SCORE:
+        return 'Track Not Found'
+    isrc = best.get('external_ids', {}).get('isrc')
+    if isrc:
+        return isrc
+    # Simplified track objects carry no external_ids; resolve them in batches
+    return _track_batcher.isrc_for(best['id'])
+
+# Persistent lookup cache (override via environment variables)
+CACHE_PATH = os.getenv('ISRC_CACHE_PATH', 'isrc_cache.sqlite')
+POSITIVE_TTL_DAYS = float(os.getenv('ISRC_CACHE_TTL_DAYS', '180'))          # ISRC found
+NEGATIVE_TTL_DAYS = float(os.getenv('ISRC_CACHE_NEGATIVE_TTL_DAYS', '14'))  # Track Not Found / No ISRC Found
+NEGATIVE_RESULTS = {'Track Not Found', 'No ISRC Found'}
+UNCACHED_RESULTS = {'API Error', 'Missing Data'}
+
+def normalize_key(text):
+    """Case-, width- and whitespace-insensitive form of a title or artist"""
+    text = unicodedata.normalize('NFKC', str(text))
+    return ' '.join(text.casefold().split())
+
+class IsrcCache:
+    """SQLite cache of get_isrc results keyed by normalized (title, artist).
+
+    Found ISRCs live for POSITIVE_TTL_DAYS, misses for NEGATIVE_TTL_DAYS so new
+    releases get picked up. Transient API errors are never cached.
+    """
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS isrc_cache ("
+            " title TEXT NOT NULL, artist TEXT NOT NULL, result TEXT NOT NULL,"
+            " expires_at REAL NOT NULL, PRIMARY KEY (title, artist))"
+        )
+        self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, title, artist):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT result FROM isrc_cache WHERE title = ? AND artist = ? AND expires_at > ?",
+                (normalize_key(title), normalize_key(artist), time.time())
+            ).fetchone()
+            if row:
+                self.hits += 1
+                return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, title, artist, result):
+        if result in UNCACHED_RESULTS:
+            return
+        ttl_days = NEGATIVE_TTL_DAYS if result in NEGATIVE_RESULTS else POSITIVE_TTL_DAYS
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO isrc_cache (title, artist, result, expires_at) VALUES (?, ?, ?, ?)",
+                (normalize_key(title), normalize_key(artist), result, time.time() + ttl_days * 86400)
+            )
+            self.conn.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        rate = (self.hits / total * 100) if total else 0.0
+        return f"Cache hits: {self.hits}, misses: {self.misses} ({rate:.1f}% hit rate)"
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+def cached_get_isrc(cache, song_title, artist, query=None, alt_title=None, duration=None):
+    result = cache.get(song_title, artist)
+    if result is None:
+        if SPOTIFY_CANDIDATES > 1:
+            result = get_isrc_scored(song_title, artist, alt_title, duration)
+        else:
+            result = get_isrc(song_title, artist, query)
+        cache.put(song_title, artist, result)
+    return result
+
+# Checkpoint journal: results are appended every JOURNAL_BATCH lookups
+JOURNAL_BATCH = int(os.getenv('ISRC_JOURNAL_BATCH', '100'))
+
+class ResultJournal:
+    """Append-only <output>.journal of finished lookups so a crashed run can resume.
+
+    API errors are not journaled, so a resumed run retries them.
+    """
+    def __init__(self, output_file):
+        self.path = output_file + '.journal'
+        self.pending = []
+
+    def load(self):
+        done = {}
+        if not os.path.exists(self.path):
+            return done
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A torn final line from a crash; everything before it is intact
+                    break
+                done[entry['key']] = entry['isrc']
+        return done
+
+    def add(self, key, isrc):
+        if isrc == 'API Error':
+            return
+        self.pending.append({'key': key, 'isrc': isrc})
+        if len(self.pending) >= JOURNAL_BATCH:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for entry in self.pending:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.pending = []
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
 def process_song_table(input_file, output_file):
     # Read input file with error handling for malformed lines
     if input_file.endswith('.csv'):
@@ -110,29 +414,63 @@ def process_song_table(input_file, output_file):
     if missing_columns:
         raise ValueError(f"Input file is missing required columns: {missing_columns}")
     
-    # Add ISRC column by searching each track, skipping rows with missing data
-    results = []
-    for idx, row in df.iterrows():
-        # Skip rows missing required data
-        if pd.isna(row['e_title']) and pd.isna(row['c_title']):
-            results.append('Missing Title')
-            continue
-        if pd.isna(row['artist_name']):
-            results.append('Missing Artist')
-            continue
-        
-        # Try English title first, fall back to Chinese title if needed
-        title_to_search = row['e_title'] if not pd.isna(row['e_title']) else row['c_title']
-        
-        isrc = get_isrc(title_to_search, row['artist_name'])
-        results.append(isrc)
-        
-        # Add delay to avoid rate limiting (Spotify allows ~30 requests per second)
-        time.sleep(0.1)  # 100ms delay between requests
-        
-        # Print progress
-        if (idx + 1) % 10 == 0:
-            print(f"Processed {idx + 1}/{len(df)} tracks")
+    # Classify rows with column operations instead of walking the frame row by row
+    missing_title = df['e_title'].isna() & df['c_title'].isna()
+    missing_artist = ~missing_title & df['artist_name'].isna()
+    valid = ~(missing_title | missing_artist)
+
+    results = pd.Series(None, index=df.index, dtype=object)
+    results[missing_title] = 'Missing Title'
+    results[missing_artist] = 'Missing Artist'
+
+    # Try English title first, fall back to Chinese title if needed
+    titles = df['e_title'].where(df['e_title'].notna(), df['c_title'])[valid].astype(str).str.strip()
+    artists = df['artist_name'][valid].astype(str).str.strip()
+    queries = 'track:' + titles + ' artist:' + artists
+    # Chinese title kept as an alternate for scoring when both titles exist
+    alt_titles = df['c_title'].where(df['e_title'].notna())[valid]
+    durations = (pd.to_numeric(df['duration'], errors='coerce')[valid] if 'duration' in df.columns
+                 else pd.Series(None, index=titles.index, dtype=float))
+
+    # Collapse duplicate songs so lookups scale with unique (title, artist) pairs, not rows
+    pair_keys = (titles.str.normalize('NFKC').str.casefold().str.split().str.join(' ') + '\x1f' +
+                 artists.str.normalize('NFKC').str.casefold().str.split().str.join(' '))
+    unique_rows = pair_keys.drop_duplicates().index
+
+    # Resume from the checkpoint journal of an interrupted run
+    journal = ResultJournal(output_file)
+    isrc_by_key = journal.load()
+    if isrc_by_key:
+        print(f"Resuming: {len(isrc_by_key)} songs already done in {journal.path}")
+        unique_rows = unique_rows[~pair_keys[unique_rows].isin(isrc_by_key.keys())]
+    lookups = list(zip(pair_keys[unique_rows], titles[unique_rows], artists[unique_rows], queries[unique_rows],
+                       alt_titles[unique_rows], durations[unique_rows]))
+    print(f"{len(lookups)} unique songs to look up across {int(valid.sum())} rows")
+
+    # Look up ISRCs concurrently; the token bucket keeps the request rate within Spotify's limits
+    cache = IsrcCache(CACHE_PATH)
+
+    def lookup(task):
+        key, title, artist, query, alt_title, duration = task
+        alt_title = None if pd.isna(alt_title) else str(alt_title).strip()
+        duration = None if pd.isna(duration) else float(duration)
+        return key, cached_get_isrc(cache, title, artist, query, alt_title, duration)
+
+    try:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            for done, (key, isrc) in enumerate(executor.map(lookup, lookups), start=1):
+                isrc_by_key[key] = isrc
+                journal.add(key, isrc)
+                # Print progress
+                if done % 10 == 0:
+                    print(f"Processed {done}/{len(lookups)} tracks")
+    finally:
+        journal.flush()
+        print(cache.stats())
+        cache.close()
+
+    # Broadcast each result back to every duplicate row; index alignment keeps input order
+    results[valid] = pair_keys.map(isrc_by_key)
     
     df['isrc'] = results
     
@@ -142,6 +480,13 @@ def process_song_table(input_file, output_file):
     else:
         df.to_excel(output_file, index=False)
 
+    # Keep the journal while any lookups failed so a rerun only retries those
+    api_errors = sum(1 for isrc in isrc_by_key.values() if isrc == 'API Error')
+    if api_errors:
+        print(f"{api_errors} lookups failed with API errors; rerun to retry them")
+    else:
+        journal.remove()
+
 # Example usage
 input_filename = r'.\ISRC\xisrc.csv'  # or .xlsx
 output_filename = r'.\ISRC\output_visrc.csv'  # or .xlsx
@@ -1,4 +1,7 @@
 import os
+import queue
+import threading
+import time
 import pandas as pd
 from dotenv import load_dotenv
 
@@ -67,21 +70,208 @@ WHERE
     )
 """
 
-# --- Export Directory ---
-output_dir = "./ISRC/exported/"
-os.makedirs(output_dir, exist_ok=True)
+# --- Bulk SQL: all IP base numbers of a batch in one pass, ip_base_no returned as a column ---
+# The DISTINCT share subquery yields each work once per matching publisher, the same rows
+# the per-publisher EXISTS in sql_template returns.
+bulk_sql_template = """
+SELECT 
+    s.ip_base_no,
+    a.worknum, 
+    a.worknum_society, 
+    a.e_title, 
+    a.c_title, 
+    a.performer AS artist_name, 
+    NULL AS isrc
+FROM (
+    SELECT 
+        m.worknum, m.worknum_society, m.genre_detail, 
+        m.sub_title_id, m.e_title, m.c_title, 
+        m.perform_language, m.performer
+    FROM webupl_macp_title m
+    UNION ALL
+    SELECT 
+        o.worknum, o.worknum_society, o.genre_detail, 
+        o.sub_title_id, o.e_title, o.c_title, 
+        o.perform_language, o.performer
+    FROM webupl_other_title o
+) a
+JOIN (
+    SELECT DISTINCT worknum, worknum_society, ip_base_no
+    FROM webupl_work_ip_share
+    WHERE ip_society_code = '104'
+    AND ip_base_no IN ({binds})
+) s
+    ON s.worknum = a.worknum
+    AND s.worknum_society = a.worknum_society
+WHERE 
+    a.sub_title_id = 0
+    AND NOT EXISTS (
+        SELECT 1 FROM webupl_work_isrc i
+        WHERE a.worknum = i.worknum_society
+        AND a.worknum_society = i.worknum_society
+    )
+"""
 
-# --- Connect to Oracle DB ---
-with oracledb.connect(user=user, password=password, dsn=dsn) as conn:
+# --- Export mode ---
+BULK_MODE = os.getenv("ISRC_BULK_MODE", "0") == "1"
+BULK_BATCH_SIZE = min(1000, int(os.getenv("ISRC_BULK_BATCH_SIZE", "500")))  # Oracle allows 1000 IN-list items
+PARALLEL_WORKERS = int(os.getenv("ISRC_PARALLEL_WORKERS", "1"))  # >1 runs per-publisher queries on a session pool
+OUTPUT_FORMAT = os.getenv("ISRC_OUTPUT_FORMAT", "csv").lower()  # csv | parquet | feather
+
+if OUTPUT_FORMAT not in ("csv", "parquet", "feather"):
+    raise ValueError(f"ISRC_OUTPUT_FORMAT must be csv, parquet or feather, got '{OUTPUT_FORMAT}'")
+if OUTPUT_FORMAT != "csv":
+    try:
+        import pyarrow as pa
+        import pyarrow.feather as feather
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError(f"ISRC_OUTPUT_FORMAT={OUTPUT_FORMAT} requires the 'pyarrow' package (pip install pyarrow)")
+
+    # Oracle column types -> Arrow types, as in local_DB.py; anything not listed (VARCHAR2, CHAR, NULL, ...) is a string
+    ORACLE_ARROW_TYPES = {
+        oracledb.DB_TYPE_BINARY_FLOAT: pa.float32(),
+        oracledb.DB_TYPE_BINARY_DOUBLE: pa.float64(),
+        oracledb.DB_TYPE_BINARY_INTEGER: pa.int64(),
+        oracledb.DB_TYPE_DATE: pa.timestamp("s"),
+        oracledb.DB_TYPE_TIMESTAMP: pa.timestamp("us"),
+        oracledb.DB_TYPE_TIMESTAMP_LTZ: pa.timestamp("us"),
+        oracledb.DB_TYPE_TIMESTAMP_TZ: pa.timestamp("us"),
+        oracledb.DB_TYPE_RAW: pa.binary(),
+        oracledb.DB_TYPE_LONG_RAW: pa.binary(),
+        oracledb.DB_TYPE_BOOLEAN: pa.bool_(),
+    }
+
+def arrow_type(col):
+    """Arrow type for one cursor.description entry (name, type, display_size, internal_size, precision, scale, null_ok)"""
+    type_code, precision, scale = col[1], col[4], col[5]
+    if type_code is oracledb.DB_TYPE_NUMBER:
+        # NUMBER(p, 0) that fits 64 bits is an integer; unconstrained or scaled NUMBER is a double
+        if scale == 0 and precision and precision <= 18:
+            return pa.int64()
+        return pa.float64()
+    return ORACLE_ARROW_TYPES.get(type_code, pa.string())
+
+def run_query(conn, sql, params):
+    """Rows of one query together with the cursor.description that types them"""
+    with conn.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.description, cursor.fetchall()
+
+def write_result(description, rows, name):
+    """Write one publisher's rows as ISRC_<name>.<format>; returns the output path"""
+    output_path = f"{output_dir}ISRC_{name}.{OUTPUT_FORMAT}"
+    if OUTPUT_FORMAT == "csv":
+        pd.DataFrame(rows, columns=[col[0] for col in description]).to_csv(output_path, index=False)
+        return output_path
+    # Typed from the Oracle columns, not from the values, so every file (even an empty one) has the same schema
+    schema = pa.schema([(col[0], arrow_type(col)) for col in description])
+    columns = list(zip(*rows)) if rows else [[] for _ in schema]
+    table = pa.Table.from_arrays([pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                                 schema=schema)
+    if OUTPUT_FORMAT == "parquet":
+        pq.write_table(table, output_path)
+    else:
+        # Uncompressed so readers can memory-map the file
+        feather.write_feather(table, output_path, compression="uncompressed")
+    return output_path
+
+def export_per_publisher(conn, ip_base_no, name):
+    print(f"Processing IP_BASE_NO: {ip_base_no}, NAME: {name}")
+    started = time.monotonic()
+    try:
+        description, rows = run_query(conn, sql_template, {"ip_base_no": ip_base_no})
+    except UnicodeDecodeError as e:
+        print(f"UnicodeDecodeError for IP_BASE_NO {ip_base_no}: {e}")
+        return None
+    output_path = write_result(description, rows, name)
+    print(f"Exported {len(rows)} rows to {output_path} in {time.monotonic() - started:.1f}s")
+    return len(rows)
+
+def export_parallel(workers):
+    """Per-publisher queries on a session pool; each worker pulls IP base entries from a shared queue"""
+    pool = oracledb.create_pool(user=user, password=password, dsn=dsn, min=1, max=workers, increment=1)
+    jobs = queue.Queue()
     for _, row in ip_base_list.iterrows():
-        ip_base_no = row['IP_BASE_NO']
-        name = row['NAME']
-        print(f"Processing IP_BASE_NO: {ip_base_no}, NAME: {name}")
+        jobs.put((row['IP_BASE_NO'], row['NAME']))
+
+    totals = {"publishers": 0, "rows": 0, "skipped": 0}
+    lock = threading.Lock()
+
+    def worker():
+        # One pooled session per worker, held for the whole run
+        with pool.acquire() as conn:
+            while True:
+                try:
+                    ip_base_no, name = jobs.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    rows = export_per_publisher(conn, ip_base_no, name)
+                except Exception as e:
+                    print(f"Error for IP_BASE_NO {ip_base_no}: {e}")
+                    rows = None
+                with lock:
+                    if rows is None:
+                        totals["skipped"] += 1
+                    else:
+                        totals["publishers"] += 1
+                        totals["rows"] += rows
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker) for _ in range(min(workers, jobs.qsize()))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    pool.close()
+    print(f"Exported {totals['rows']} rows for {totals['publishers']} publishers "
+          f"({totals['skipped']} skipped) with {len(threads)} workers in {time.monotonic() - started:.1f}s")
+
+def export_bulk(conn):
+    """One query per batch of IP base numbers, split into per-publisher CSVs client-side"""
+    ip_base_nos = list(dict.fromkeys(ip_base_list['IP_BASE_NO']))
+    description = None
+    groups = {}
+    failed = set()
+    for start in range(0, len(ip_base_nos), BULK_BATCH_SIZE):
+        batch = ip_base_nos[start:start + BULK_BATCH_SIZE]
+        binds = ", ".join(f":b{i}" for i in range(len(batch)))
+        params = {f"b{i}": value for i, value in enumerate(batch)}
+        print(f"Querying IP_BASE_NO batch {start + 1}-{start + len(batch)} of {len(ip_base_nos)}")
         try:
-            result = pd.read_sql(sql_template, conn, params={"ip_base_no": ip_base_no})
+            batch_description, rows = run_query(conn, bulk_sql_template.format(binds=binds), params)
         except UnicodeDecodeError as e:
-            print(f"UnicodeDecodeError for IP_BASE_NO {ip_base_no}: {e}")
+            # Fall back to per-publisher queries so one bad row only skips its own publisher
+            print(f"UnicodeDecodeError in bulk batch, retrying per publisher: {e}")
+            failed.update(batch)
+            continue
+        # ip_base_no is the first column; the rest match the per-publisher export
+        description = batch_description[1:]
+        for row in rows:
+            groups.setdefault(row[0], []).append(row[1:])
+
+    for _, row in ip_base_list.iterrows():
+        ip_base_no = row['IP_BASE_NO']
+        name = row['NAME']
+        if ip_base_no in failed:
+            export_per_publisher(conn, ip_base_no, name)
             continue
-        output_path = f"{output_dir}ISRC_{name}.csv"
-        result.to_csv(output_path, index=False)
-        print(f"Exported to {output_path}")
+        rows = groups.get(ip_base_no, [])
+        output_path = write_result(description, rows, name)
+        print(f"Exported {len(rows)} rows for IP_BASE_NO {ip_base_no} to {output_path}")
+
+# --- Export Directory ---
+output_dir = "./ISRC/exported/"
+os.makedirs(output_dir, exist_ok=True)
+
+# --- Connect to Oracle DB ---
+if PARALLEL_WORKERS > 1 and not BULK_MODE:
+    export_parallel(PARALLEL_WORKERS)
+else:
+    with oracledb.connect(user=user, password=password, dsn=dsn) as conn:
+        if BULK_MODE:
+            export_bulk(conn)
+        else:
+            for _, row in ip_base_list.iterrows():
+                export_per_publisher(conn, row['IP_BASE_NO'], row['NAME'])
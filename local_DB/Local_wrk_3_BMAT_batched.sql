@@ -0,0 +1,56 @@
+with works as (
+       -- Both right types in one pass; the DISTINCT stands in for the UNION of the original query.
+       -- local_DB.py replaces the society_filter comment with a worknum_society bind in partitioned mode.
+       select /*+ materialize */ distinct w.worknum, w.worknum_society, nvl(t.c_title, t.e_title) ot_title, t.e_title, r.distributable, r.right_type
+       from   wrk_work w,
+              wrk_title t,
+              wrk_work_right r
+       where  w.worknum = t.worknum
+       and    w.worknum_society = t.worknum_society
+       and    t.sub_title_id = 0
+       and    w.worknum = r.worknum
+       and    w.worknum_society = r.worknum_society
+       and    r.right_type in ('MEC', 'PER')
+       /* society_filter */
+       --and    r.distributable = 'Y'
+       and    exists(select 1 from wrk_work_ip_share x, mbr_one_ip_name y, mbr_ip z, mbr_member_header h
+                     where  x.worknum = r.worknum
+                     and    x.worknum_society = r.worknum_society
+                     and    x.right_type = r.right_type
+                     and    x.ip_name_no = y.ip_name_no
+                     and    y.ip_base_no = z.ip_base_no
+                     --and    z.ip_type = 'N' -- writer only
+                     and    z.ip_base_no = h.ip_base_no
+                    -- and    z.ip_base_no = 'I0001650117' -- publisher
+                     and    h.terminate_date is null
+                     and    h.joint_date is not null
+                    )
+      ),
+     work_info as (
+       -- Artist and ISWC depend only on the work: one call per work instead of one per row
+       select /*+ materialize */ worknum, worknum_society,
+              f_get_artist(worknum, worknum_society) performer, f_get_iswc(worknum, worknum_society) iswc
+       from  (select distinct worknum, worknum_society from works)
+      ),
+     right_info as (
+       -- Interested-party info once per (work, right type)
+       select /*+ materialize */ worknum, worknum_society, right_type,
+              f_get_wip_name_v2(worknum, worknum_society, p_right_type=>right_type, p_column=>5) ip_info
+       from  (select distinct worknum, worknum_society, right_type from works)
+      )
+select decode(a.worknum_society, 026, 'C-',
+      104, 'P-',
+      119, 'M-',
+      126, 'H-',
+      161, 'U-',
+      265, 'K-',
+      269, 'W-') || a.worknum worknum, a.worknum_society, a.ot_title, a.e_title, a.right_type,
+       i.performer, i.iswc ISWC, p.ip_info, a.distributable
+from   works a,
+       work_info i,
+       right_info p
+where  a.worknum = i.worknum
+and    a.worknum_society = i.worknum_society
+and    a.worknum = p.worknum
+and    a.worknum_society = p.worknum_society
+and    a.right_type = p.right_type;
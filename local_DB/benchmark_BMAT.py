@@ -0,0 +1,94 @@
+import os
+import hashlib
+import time
+from dotenv import load_dotenv
+
+# --- Load environment variables ---
+load_dotenv()
+
+# Load Oracle Instant Client path from env
+instant_client_path = os.getenv("ORACLE_INSTANTCLIENT_PATH")
+if not instant_client_path:
+    raise ValueError("ORACLE_INSTANTCLIENT_PATH must be set in .env")
+
+# Explicitly set PATH to include Oracle Instant Client directory before importing oracledb
+os.environ["PATH"] = instant_client_path + ";" + os.environ.get("PATH", "")
+
+import oracledb
+
+# Enable thick mode for oracledb to support password verifier type 0x939
+oracledb.init_oracle_client(lib_dir=instant_client_path)
+
+# Load TNS_ADMIN path from env
+tns_admin_path = os.getenv("ORACLE_TNS_ADMIN")
+if not tns_admin_path:
+    raise ValueError("ORACLE_TNS_ADMIN must be set in .env")
+os.environ["TNS_ADMIN"] = tns_admin_path
+
+user = os.getenv("ORACLE_USER")
+password = os.getenv("ORACLE_PASSWORD")
+
+# Use TNS alias as DSN
+dsn = os.getenv("ORACLE_TNS_ALIAS")
+if not dsn:
+    raise ValueError("ORACLE_TNS_ALIAS must be set in .env")
+
+# --- Queries to compare ---
+base_dir = os.path.dirname(__file__)
+variants = {
+    "per-row": os.path.join(base_dir, os.getenv("SQL_FILE_PATH", "Local_wrk_3_BMAT.sql")),
+    "batched": os.path.join(base_dir, os.getenv("SQL_FILE_PATH_BATCHED", "Local_wrk_3_BMAT_batched.sql")),
+}
+FETCH_SIZE = int(os.getenv("LOCALDB_FETCH_SIZE", "5000"))
+
+def read_sql(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read().strip().rstrip(';')
+
+def run(cursor, sql_query):
+    """Fetch the whole result, timing first row and total, with an order-independent digest of the rows"""
+    cursor.arraysize = FETCH_SIZE
+    cursor.prefetchrows = FETCH_SIZE + 1
+    started = time.perf_counter()
+    cursor.execute(sql_query)
+    columns = [col[0] for col in cursor.description]
+    first_row = None
+    row_count = 0
+    digest = 0
+    while True:
+        rows = cursor.fetchmany()
+        if not rows:
+            break
+        if first_row is None:
+            first_row = time.perf_counter() - started
+        for row in rows:
+            values = "\x1f".join("" if value is None else str(value) for value in row)
+            # Sum of row hashes: equal for the same multiset of rows in any order
+            digest = (digest + int(hashlib.sha1(values.encode("utf-8")).hexdigest(), 16)) % (1 << 160)
+        row_count += len(rows)
+    return {
+        "columns": columns,
+        "rows": row_count,
+        "first_row": first_row or 0.0,
+        "total": time.perf_counter() - started,
+        "digest": f"{digest:040x}",
+    }
+
+# --- Run both variants on one connection ---
+results = {}
+with oracledb.connect(user=user, password=password, dsn=dsn) as conn:
+    for name, path in variants.items():
+        print(f"Running {name} query from {path}")
+        with conn.cursor() as cursor:
+            results[name] = run(cursor, read_sql(path))
+        r = results[name]
+        print(f"  {r['rows']} rows, first row after {r['first_row']:.1f}s, total {r['total']:.1f}s")
+
+baseline, batched = results["per-row"], results["batched"]
+print(f"Speed-up: {baseline['total'] / batched['total']:.2f}x" if batched["total"] else "Speed-up: n/a")
+if baseline["columns"] != batched["columns"]:
+    print(f"Column mismatch: {baseline['columns']} vs {batched['columns']}")
+elif baseline["rows"] != batched["rows"] or baseline["digest"] != batched["digest"]:
+    print("Result mismatch: row counts or row contents differ")
+else:
+    print("Results identical")
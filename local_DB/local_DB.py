@@ -3,7 +3,14 @@ import pandas as pd
 from dotenv import load_dotenv
 from datetime import datetime
 import csv
+import gzip
+import hashlib
+import json
 import shutil
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # --- Load environment variables ---
 load_dotenv()
@@ -47,33 +54,492 @@ sql_file_path = os.path.join(os.path.dirname(__file__), sql_file_path)
 with open(sql_file_path, "r", encoding="utf-8") as f:
     sql_query = f.read().strip().rstrip(';')
 
+# --- Export mode ---
+STREAMING = os.getenv("LOCALDB_STREAMING", "0") == "1"    # fetchmany batches written straight to CSV
+FETCH_SIZE = int(os.getenv("LOCALDB_FETCH_SIZE", "5000"))  # Rows per round trip and per CSV batch
+INCREMENTAL = os.getenv("LOCALDB_INCREMENTAL", "0") == "1"  # Ship an inserts/updates/deletes delta instead of a full dump
+BASELINE_DAYS = int(os.getenv("LOCALDB_BASELINE_DAYS", "7"))  # Days between full baseline files in incremental mode
+KEY_COLUMNS = ("worknum", "worknum_society", "right_type")
+PARALLEL_WORKERS = int(os.getenv("LOCALDB_PARALLEL_WORKERS", "1"))  # >1 extracts one partition per society in parallel
+PARTITION_SOCIETIES = os.getenv("LOCALDB_PARTITION_SOCIETIES", "")  # Comma-separated; empty = all societies in wrk_work
+COMPRESSION = os.getenv("LOCALDB_COMPRESSION", "none").lower()  # none | gzip | zstd, applied while writing
+SIDECAR = os.getenv("LOCALDB_SIDECAR", "0") == "1"               # Deliver <file>.meta.json with sha256 and row count
+OUTPUT_FORMAT = os.getenv("LOCALDB_OUTPUT_FORMAT", "csv").lower()  # csv | parquet | feather
+PARQUET_ROW_GROUP_ROWS = int(os.getenv("LOCALDB_PARQUET_ROW_GROUP_ROWS", "1000000"))  # Fetch batches are buffered up to this
+
+COMPRESSION_SUFFIXES = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+if COMPRESSION not in COMPRESSION_SUFFIXES:
+    raise ValueError("LOCALDB_COMPRESSION must be one of: none, gzip, zstd")
+
+if OUTPUT_FORMAT not in ("csv", "parquet", "feather"):
+    raise ValueError(f"LOCALDB_OUTPUT_FORMAT must be csv, parquet or feather, got '{OUTPUT_FORMAT}'")
+if OUTPUT_FORMAT != "csv" and INCREMENTAL:
+    raise ValueError("LOCALDB_INCREMENTAL writes CSV deltas; use LOCALDB_OUTPUT_FORMAT=csv")
+if OUTPUT_FORMAT == "feather" and COMPRESSION == "gzip":
+    raise ValueError("Feather (Arrow IPC) supports zstd compression only")
+
+if COMPRESSION == "zstd" and OUTPUT_FORMAT == "csv":
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("LOCALDB_COMPRESSION=zstd requires the zstandard package (pip install zstandard)")
+
+if OUTPUT_FORMAT != "csv":
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError(f"LOCALDB_OUTPUT_FORMAT={OUTPUT_FORMAT} requires the 'pyarrow' package (pip install pyarrow)")
+
+    # Oracle column types -> Arrow types; anything not listed (VARCHAR2, CHAR, NVARCHAR2, ...) is a string
+    ORACLE_ARROW_TYPES = {
+        oracledb.DB_TYPE_BINARY_FLOAT: pa.float32(),
+        oracledb.DB_TYPE_BINARY_DOUBLE: pa.float64(),
+        oracledb.DB_TYPE_BINARY_INTEGER: pa.int64(),
+        oracledb.DB_TYPE_DATE: pa.timestamp("s"),
+        oracledb.DB_TYPE_TIMESTAMP: pa.timestamp("us"),
+        oracledb.DB_TYPE_TIMESTAMP_LTZ: pa.timestamp("us"),
+        oracledb.DB_TYPE_TIMESTAMP_TZ: pa.timestamp("us"),
+        oracledb.DB_TYPE_RAW: pa.binary(),
+        oracledb.DB_TYPE_LONG_RAW: pa.binary(),
+        oracledb.DB_TYPE_BOOLEAN: pa.bool_(),
+    }
+
 # --- Export Directory ---
 output_dir = os.path.join(os.path.dirname(__file__), "csvDB")
 os.makedirs(output_dir, exist_ok=True)
 
-# --- Connect to Oracle DB and execute query ---
-with oracledb.connect(user=user, password=password, dsn=dsn) as conn:
+SNAPSHOT_PATH = os.getenv("LOCALDB_SNAPSHOT_PATH", os.path.join(output_dir, "snapshot.sqlite"))
+
+today_str = datetime.now().strftime("%Y%m%d")
+suffix = COMPRESSION_SUFFIXES[COMPRESSION]
+if OUTPUT_FORMAT == "csv":
+    output_path = os.path.join(output_dir, f"LocalDB_{today_str}.csv{suffix}")
+else:
+    # Parquet and Feather compress internally; an uncompressed Feather file can be memory-mapped on read
+    output_path = os.path.join(output_dir, f"LocalDB_{today_str}.{OUTPUT_FORMAT}")
+delta_path = os.path.join(output_dir, f"LocalDB_delta_{today_str}.csv{suffix}")
+
+def open_output(path):
+    """Text handle for an export file, compressed on the fly per LOCALDB_COMPRESSION"""
+    if COMPRESSION == "gzip":
+        return gzip.open(path, "wt", newline="", encoding="utf-8")
+    if COMPRESSION == "zstd":
+        return zstandard.open(path, "wt", newline="", encoding="utf-8")
+    return open(path, "w", newline="", encoding="utf-8")
+
+def open_csv_writer(f):
+    # Same dialect as DataFrame.to_csv(sep='\t', quoting=csv.QUOTE_ALL)
+    return csv.writer(f, delimiter='\t', quoting=csv.QUOTE_ALL, lineterminator=os.linesep)
+
+def arrow_type(col):
+    """Arrow type for one cursor.description entry (name, type, display_size, internal_size, precision, scale, null_ok)"""
+    type_code, precision, scale = col[1], col[4], col[5]
+    if type_code is oracledb.DB_TYPE_NUMBER:
+        # NUMBER(p, 0) that fits 64 bits is an integer; unconstrained or scaled NUMBER is a double
+        if scale == 0 and precision and precision <= 18:
+            return pa.int64()
+        return pa.float64()
+    return ORACLE_ARROW_TYPES.get(type_code, pa.string())
+
+class CsvExportWriter:
+    """Tab-separated, fully quoted CSV; compressed per LOCALDB_COMPRESSION unless it is an intermediate part"""
+    def __init__(self, path, columns, header=True, compressed=True):
+        self.file = open_output(path) if compressed else open(path, "w", newline="", encoding="utf-8")
+        self.writer = open_csv_writer(self.file)
+        if header:
+            self.writer.writerow(columns)
+        self.rows = 0
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+        self.rows += len(rows)
+
+    def close(self):
+        self.file.close()
+
+class ArrowExportWriter:
+    """Parquet or Arrow IPC (Feather v2) file with a schema derived from the Oracle column types"""
+    def __init__(self, path, description, fmt, compressed=True):
+        self.schema = pa.schema([(col[0], arrow_type(col)) for col in description])
+        self.fmt = fmt
+        codec = COMPRESSION if compressed and COMPRESSION != "none" else None
+        if fmt == "parquet":
+            self.writer = pq.ParquetWriter(path, self.schema, compression=codec or "snappy")
+            # Fetch batches are small; collect them so each row group is large enough to read efficiently
+            self.pending = []
+            self.pending_rows = 0
+        else:
+            options = pa.ipc.IpcWriteOptions(compression=codec)
+            self.writer = pa.ipc.new_file(path, self.schema, options=options)
+        self.rows = 0
+
+    def write(self, rows):
+        arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), self.schema)]
+        self.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+
+    def write_batch(self, batch):
+        if self.fmt == "parquet":
+            self.pending.append(batch)
+            self.pending_rows += batch.num_rows
+            if self.pending_rows >= PARQUET_ROW_GROUP_ROWS:
+                self.flush_row_group()
+        else:
+            self.writer.write_batch(batch)
+        self.rows += batch.num_rows
+
+    def flush_row_group(self):
+        if self.pending:
+            table = pa.Table.from_batches(self.pending, schema=self.schema)
+            self.writer.write_table(table, row_group_size=table.num_rows)
+            self.pending = []
+            self.pending_rows = 0
+
+    def close(self):
+        if self.fmt == "parquet":
+            self.flush_row_group()
+        self.writer.close()
+
+def open_export_writer(path, description, header=True, part=False):
+    """Writer for LOCALDB_OUTPUT_FORMAT; parts are plain CSV or uncompressed Arrow IPC for a cheap merge"""
+    if OUTPUT_FORMAT == "csv":
+        return CsvExportWriter(path, [col[0] for col in description], header=header, compressed=not part)
+    return ArrowExportWriter(path, description, "feather" if part else OUTPUT_FORMAT, compressed=not part)
+
+def execute_streaming(cursor, query=None, params=None):
+    cursor.arraysize = FETCH_SIZE
+    cursor.prefetchrows = FETCH_SIZE + 1  # First round trip also fills a whole batch
+    cursor.execute(query or sql_query, params or {})
+    return [col[0] for col in cursor.description]
+
+def iter_batches(cursor):
+    while True:
+        rows = cursor.fetchmany()
+        if not rows:
+            return
+        yield rows
+
+def export_streaming(cursor, path):
+    """Write each fetchmany batch straight to the output so memory is bounded by FETCH_SIZE"""
+    execute_streaming(cursor)
+    writer = open_export_writer(path, cursor.description)
+    try:
+        for rows in iter_batches(cursor):
+            writer.write(rows)
+    finally:
+        writer.close()
+    return writer.rows
+
+class SnapshotStore:
+    """Per-row keys and content hashes of the last delivered export, kept in SQLite.
+
+    Keys are (worknum, worknum_society, right_type). A key whose set of row hashes differs
+    from the snapshot is emitted as an insert or update with all of its current rows; a key
+    that disappeared is emitted as a delete. The snapshot only advances on commit(), after
+    the files reached DESTINATION_FOLDER, so a failed copy is re-sent in the next delta.
+    """
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS snapshot (key TEXT, hash TEXT)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS snapshot_key ON snapshot (key)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        self.conn.execute("CREATE TEMP TABLE cur (key TEXT, hash TEXT, row TEXT)")
+        self.key_index = None
+
+    def is_empty(self):
+        return self.conn.execute("SELECT 1 FROM snapshot LIMIT 1").fetchone() is None
+
+    def meta(self, name):
+        row = self.conn.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def needs_baseline(self, columns):
+        last = self.meta("last_baseline")
+        if last is None or self.meta("columns") != json.dumps(columns):
+            return True
+        return (datetime.now() - datetime.strptime(last, "%Y%m%d")).days >= BASELINE_DAYS
+
+    def begin(self, columns):
+        lowered = [col.lower() for col in columns]
+        missing = [key for key in KEY_COLUMNS if key not in lowered]
+        if missing:
+            raise ValueError(f"Incremental export needs key columns missing from the query: {missing}")
+        self.columns = columns
+        self.key_index = [lowered.index(key) for key in KEY_COLUMNS]
+
+    def add(self, rows):
+        records = []
+        for row in rows:
+            values = ["" if value is None else str(value) for value in row]
+            key = json.dumps([values[i] for i in self.key_index], ensure_ascii=False)
+            digest = hashlib.sha1("\x1f".join(values).encode("utf-8")).hexdigest()
+            records.append((key, digest, json.dumps(values, ensure_ascii=False)))
+        self.conn.executemany("INSERT INTO cur VALUES (?, ?, ?)", records)
+
+    def write_delta(self, path):
+        self.conn.execute("CREATE INDEX temp.cur_key ON cur (key)")
+        self.conn.execute("""
+            CREATE TEMP TABLE changed AS
+            SELECT key FROM (SELECT key, hash FROM cur EXCEPT SELECT key, hash FROM snapshot)
+            UNION
+            SELECT key FROM (SELECT key, hash FROM snapshot EXCEPT SELECT key, hash FROM cur)
+        """)
+        counts = {"insert": 0, "update": 0, "delete": 0}
+        with open_output(path) as f:
+            writer = open_csv_writer(f)
+            writer.writerow(["op"] + self.columns)
+            upserts = self.conn.execute("""
+                SELECT c.row, EXISTS (SELECT 1 FROM snapshot s WHERE s.key = c.key)
+                FROM cur c JOIN changed USING (key)
+            """)
+            for row, existed in upserts:
+                op = "update" if existed else "insert"
+                writer.writerow([op] + json.loads(row))
+                counts[op] += 1
+            deletes = self.conn.execute("""
+                SELECT DISTINCT s.key FROM snapshot s JOIN changed USING (key)
+                WHERE NOT EXISTS (SELECT 1 FROM cur c WHERE c.key = s.key)
+            """)
+            for (key,) in deletes:
+                row = [""] * len(self.columns)
+                for i, value in zip(self.key_index, json.loads(key)):
+                    row[i] = value
+                writer.writerow(["delete"] + row)
+                counts["delete"] += 1
+        return counts
+
+    def commit(self, baseline):
+        self.conn.execute("DELETE FROM snapshot")
+        self.conn.execute("INSERT INTO snapshot SELECT key, hash FROM cur")
+        self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('columns', ?)", (json.dumps(self.columns),))
+        if baseline:
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('last_baseline', ?)", (today_str,))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+def export_incremental(cursor, store):
+    """Stream the query into the snapshot store, writing a full baseline CSV when one is due"""
+    columns = execute_streaming(cursor)
+    store.begin(columns)
+    baseline = store.needs_baseline(columns)
+    row_count = 0
+    baseline_file = open_output(output_path) if baseline else None
+    try:
+        writer = open_csv_writer(baseline_file) if baseline else None
+        if writer:
+            writer.writerow(columns)
+        for rows in iter_batches(cursor):
+            store.add(rows)
+            if writer:
+                writer.writerows(rows)
+            row_count += len(rows)
+    finally:
+        if baseline_file:
+            baseline_file.close()
+    return row_count, baseline
+
+# Queries can mark where the society filter belongs; needed when it sits behind materialized
+# WITH blocks (Local_wrk_3_BMAT_batched.sql), where Oracle cannot push an outer predicate down
+SOCIETY_FILTER_MARKER = "/* society_filter */"
+if SOCIETY_FILTER_MARKER in sql_query:
+    partition_query = sql_query.replace(SOCIETY_FILTER_MARKER, "and w.worknum_society = :society")
+else:
+    # worknum_society passes through the query unchanged, so Oracle can push this filter into each UNION branch
+    partition_query = f"select * from ({sql_query}) where worknum_society = :society"
+
+def list_societies(conn):
+    if PARTITION_SOCIETIES:
+        return [society.strip() for society in PARTITION_SOCIETIES.split(",") if society.strip()]
     with conn.cursor() as cursor:
-        cursor.execute(sql_query)
-        columns = [col[0] for col in cursor.description]
-        rows = cursor.fetchall()
+        cursor.execute("select distinct worknum_society from wrk_work order by worknum_society")
+        return [row[0] for row in cursor.fetchall()]
 
-# --- Load results into DataFrame ---
-df = pd.DataFrame(rows, columns=columns)
+def export_partition(pool, society, part_path, active, stop):
+    """Stream one society's rows to its own part file (no header); returns the description and row count"""
+    started = time.monotonic()
+    with pool.acquire() as conn:
+        active[society] = conn
+        try:
+            if stop.is_set():
+                raise RuntimeError("export aborted")
+            with conn.cursor() as cursor:
+                execute_streaming(cursor, partition_query, {"society": society})
+                description = cursor.description
+                writer = open_export_writer(part_path, description, header=False, part=True)
+                try:
+                    for rows in iter_batches(cursor):
+                        writer.write(rows)
+                finally:
+                    writer.close()
+        finally:
+            active.pop(society, None)
+    print(f"Society {society}: {writer.rows} rows in {time.monotonic() - started:.1f}s")
+    return description, writer.rows
 
-# --- Export to CSV with tab separator and quoted fields ---
-today_str = datetime.now().strftime("%Y%m%d")
-output_path = os.path.join(output_dir, f"LocalDB_{today_str}.csv")
-df.to_csv(output_path, sep='\t', index=False, quoting=csv.QUOTE_ALL)
-print(f"Exported query results to {output_path}")
+def export_partitioned(path):
+    """Extract each society on its own pooled connection, then concatenate the parts under one header"""
+    pool = oracledb.create_pool(user=user, password=password, dsn=dsn, min=1, max=PARALLEL_WORKERS, increment=1)
+    parts_dir = os.path.join(output_dir, f"parts_{today_str}")
+    try:
+        with pool.acquire() as conn:
+            societies = list_societies(conn)
+        os.makedirs(parts_dir, exist_ok=True)
+        part_ext = "csv" if OUTPUT_FORMAT == "csv" else "arrow"
+        part_paths = {society: os.path.join(parts_dir, f"part_{society}.{part_ext}") for society in societies}
+
+        description = None
+        row_count = 0
+        active = {}
+        stop = threading.Event()
+        with ThreadPoolExecutor(max_workers=PARALLEL_WORKERS) as executor:
+            futures = {executor.submit(export_partition, pool, society, part_paths[society], active, stop): society
+                       for society in societies}
+            for future in as_completed(futures):
+                try:
+                    part_description, part_rows = future.result()
+                except Exception as e:
+                    # Any failed partition aborts the export: drop queued partitions and interrupt running ones
+                    print(f"Society {futures[future]} failed: {e}; aborting remaining partitions")
+                    stop.set()
+                    for pending in futures:
+                        pending.cancel()
+                    for conn in list(active.values()):
+                        try:
+                            conn.cancel()
+                        except Exception:
+                            pass
+                    raise
+                description = description or part_description
+                row_count += part_rows
+
+        if description is None:
+            raise ValueError("No partitions to export; check LOCALDB_PARTITION_SOCIETIES")
+        if OUTPUT_FORMAT == "csv":
+            with open_output(path) as out:
+                open_csv_writer(out).writerow([col[0] for col in description])
+                for society in societies:
+                    with open(part_paths[society], "r", newline="", encoding="utf-8") as part:
+                        shutil.copyfileobj(part, out)
+        else:
+            writer = open_export_writer(path, description)
+            try:
+                for society in societies:
+                    with pa.memory_map(part_paths[society]) as source:
+                        reader = pa.ipc.open_file(source)
+                        for i in range(reader.num_record_batches):
+                            writer.write_batch(reader.get_batch(i))
+            finally:
+                writer.close()
+    finally:
+        shutil.rmtree(parts_dir, ignore_errors=True)
+        pool.close(force=True)
+    return row_count, len(societies)
+
+def deliver(path, row_count, destination):
+    """Copy to a temporary name on the share, then rename, so consumers never see a partial file.
+
+    The sha256 is computed from the bytes as they are copied. With LOCALDB_SIDECAR=1 a
+    <file>.meta.json with checksum and row count is published after the data file.
+    """
+    name = os.path.basename(path)
+    final_path = os.path.join(destination, name)
+    tmp_path = os.path.join(destination, f".{name}.tmp")
+    sha256 = hashlib.sha256()
+    try:
+        with open(path, "rb") as src, open(tmp_path, "wb") as dst:
+            for chunk in iter(lambda: src.read(1024 * 1024), b""):
+                sha256.update(chunk)
+                dst.write(chunk)
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(tmp_path, final_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    if SIDECAR:
+        meta = {
+            "file": name,
+            "sha256": sha256.hexdigest(),
+            "rows": row_count,
+            "bytes": os.path.getsize(path),
+            "compression": COMPRESSION,
+            "created": datetime.now().isoformat(timespec="seconds"),
+        }
+        meta_tmp = os.path.join(destination, f".{name}.meta.json.tmp")
+        with open(meta_tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(meta_tmp, os.path.join(destination, f"{name}.meta.json"))
+    return sha256.hexdigest()
+
+# --- Connect to Oracle DB and execute query ---
+files_to_copy = []
+snapshot = None
+baseline = False
+if INCREMENTAL:
+    snapshot = SnapshotStore(SNAPSHOT_PATH)
+    with oracledb.connect(user=user, password=password, dsn=dsn) as conn:
+        with conn.cursor() as cursor:
+            row_count, baseline = export_incremental(cursor, snapshot)
+    if baseline and snapshot.is_empty():
+        # First run: the delta would repeat the whole baseline as inserts
+        print(f"Read {row_count} rows; no previous snapshot, shipping the baseline only")
+    else:
+        counts = snapshot.write_delta(delta_path)
+        print(f"Read {row_count} rows; delta has {counts['insert']} inserts, "
+              f"{counts['update']} updates, {counts['delete']} deletes -> {delta_path}")
+        files_to_copy = [(delta_path, sum(counts.values()))]
+    if baseline:
+        print(f"Wrote full baseline to {output_path}")
+        files_to_copy.insert(0, (output_path, row_count))
+elif PARALLEL_WORKERS > 1:
+    started = time.monotonic()
+    row_count, partitions = export_partitioned(output_path)
+    print(f"Exported {row_count} rows from {partitions} partitions to {output_path} "
+          f"in {time.monotonic() - started:.1f}s")
+    files_to_copy = [(output_path, row_count)]
+elif STREAMING or OUTPUT_FORMAT != "csv":
+    with oracledb.connect(user=user, password=password, dsn=dsn) as conn:
+        with conn.cursor() as cursor:
+            row_count = export_streaming(cursor, output_path)
+    print(f"Exported {row_count} rows to {output_path}")
+    files_to_copy = [(output_path, row_count)]
+else:
+    with oracledb.connect(user=user, password=password, dsn=dsn) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(sql_query)
+            columns = [col[0] for col in cursor.description]
+            rows = cursor.fetchall()
+
+    # --- Load results into DataFrame ---
+    df = pd.DataFrame(rows, columns=columns)
+
+    # --- Export to CSV with tab separator and quoted fields ---
+    with open_output(output_path) as f:
+        df.to_csv(f, sep='\t', index=False, quoting=csv.QUOTE_ALL)
+    print(f"Exported query results to {output_path}")
+    files_to_copy = [(output_path, len(df))]
 
 # --- Copy exported CSV to network destination folder ---
 destination_folder = os.getenv("DESTINATION_FOLDER")
 if not destination_folder:
     raise ValueError("DESTINATION_FOLDER must be set in .env")
 
-try:
-    shutil.copy(output_path, destination_folder)
-    print(f"Successfully copied {output_path} to {destination_folder}")
-except Exception as e:
-    print(f"Error copying file to network path: {e}")
+copied = True
+for path, file_rows in files_to_copy:
+    try:
+        checksum = deliver(path, file_rows, destination_folder)
+        print(f"Successfully copied {path} to {destination_folder} (sha256 {checksum})")
+    except Exception as e:
+        copied = False
+        print(f"Error copying file to network path: {e}")
+
+if snapshot:
+    if copied:
+        snapshot.commit(baseline)
+    else:
+        print("Snapshot not advanced; the next delta will include these changes again")
+    snapshot.close()